@@ -0,0 +1,384 @@
+"""
+Async versions of the Conversation / Message endpoints, running on the
+asyncmy engine. Enabled with DB_ASYNC=1; each request then waits on the
+connection pool instead of holding a threadpool thread.
+"""
+import logging
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+
+from auth_utils import verify_token_async
+from database import async_engine, async_read_router
+from log_utils import log_event
+from models.conversation_models import ConversationCreate, ConversationRead
+from models.message_models import MessageCreate, MessageRead
+import tables
+import write_behind
+import group_commit
+import pagination
+import etags
+import export
+
+router = APIRouter()
+
+
+# ============================================================
+# Conversations Endpoints
+# ============================================================
+
+
+@router.get("/conversations")
+async def get_conversations(
+    response: Response,
+    limit: int = Query(pagination.CONVERSATIONS_PAGE_SIZE, ge=1, le=pagination.CONVERSATIONS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fresh: bool = False,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    if_none_match: Optional[str] = Header(None),
+    user: Dict[str, Any] = Depends(verify_token_async),
+):
+    user_id = user["user_id"]
+    role = user.get("role", "user")
+
+    log_event("conversations.list", logging.DEBUG, user_id=user_id, role=role)
+
+    if format == "ndjson":
+        # admin 导出全部对话，逐块流式输出，内存占用与表大小无关
+        if role != "admin":
+            raise HTTPException(status_code=403, detail="Export is admin only")
+        return StreamingResponse(export.stream_conversations_async(async_read_router.async_connect), media_type=export.NDJSON)
+
+    if fresh:
+        await write_behind.last_message_at.flush_async(async_engine)
+    scope = "all" if role == "admin" else "user"
+    query, params = pagination.conversation_page(scope, user_id, limit, cursor)
+    async with (async_engine.connect() if fresh else async_read_router.async_connect(user_id=user_id)) as conn:
+        if scope == "user":
+            # 轮询时先比较收件箱版本，没变就 304，不跑分页查询
+            version = (await conn.execute(tables.SELECT_INBOX_VERSION, {"uid": user_id})).one()
+            headers = {
+                "ETag": pagination.inbox_etag(user_id, limit, cursor, version),
+                "Cache-Control": etags.PRIVATE_REVALIDATE,
+            }
+            if etags.matches(if_none_match, headers["ETag"]):
+                return etags.not_modified(headers)
+            response.headers.update(headers)
+        rows = [dict(row._mapping) for row in await conn.execute(query, params)]
+    return pagination.page_response(rows, limit)
+
+
+@router.post("/conversations", response_model=ConversationRead)
+async def create_conversation(conv: ConversationCreate):
+    async with async_engine.begin() as conn:
+        # enforce user_a_id < user_b_id convention
+        user_a_id, user_b_id = sorted([conv.user_a_id, conv.user_b_id])
+
+        unis = {conv.user_a_id: getattr(conv, 'user_a_uni', f"user_{conv.user_a_id}"),
+                conv.user_b_id: getattr(conv, 'user_b_uni', f"user_{conv.user_b_id}")}
+
+        # Auto-create users if they don't exist
+        for user_id in [user_a_id, user_b_id]:
+            check = (await conn.execute(
+                tables.SELECT_USER_ID, {"user_id": user_id}
+            )).fetchone()
+            log_event("conversation.user_checked", logging.DEBUG, user_id=user_id, exists=check is not None)
+            if not check:
+                try:
+                    await conn.execute(
+                        tables.INSERT_USER,
+                        {"user_id": user_id, "uni": unis[user_id], "name": unis[user_id], "email": f"{unis[user_id]}@columbia.edu"},
+                    )
+                    log_event("conversation.user_created", user_id=user_id, uni=unis[user_id])
+                except Exception as e:
+                    log_event("conversation.user_create_failed", logging.ERROR, user_id=user_id, error=str(e))
+                    raise
+
+        # Check if conversation already exists
+        check_query = tables.SELECT_CONVERSATION_BY_PAIR
+        existing = (await conn.execute(check_query, {"user_a": user_a_id, "user_b": user_b_id})).mappings().first()
+
+        if existing:
+            log_event("conversation.exists", logging.DEBUG, conversation_id=existing["conversation_id"])
+            return dict(existing)
+
+        log_event("conversation.create", user_a_id=user_a_id, user_b_id=user_b_id)
+        insert_stmt = tables.INSERT_CONVERSATION
+        result = await conn.execute(
+            insert_stmt, {"user_a_id": user_a_id, "user_b_id": user_b_id, "created_at": tables.db_now()}
+        )
+
+        conversation_id = result.lastrowid
+        # 双方的收件箱各一行
+        await conn.execute(tables.INSERT_INBOX, {"cid": conversation_id})
+
+        query = tables.SELECT_CONVERSATION
+        row = (await conn.execute(query, {"cid": conversation_id})).mappings().first()
+
+    if not row:
+        raise HTTPException(status_code=500, detail="Failed to create conversation")
+    async_read_router.note_write(user_id=user_a_id, conversation_id=conversation_id)
+    async_read_router.note_write(user_id=user_b_id)
+    return dict(row)
+
+
+@router.get("/conversations/{conversation_id}", response_model=ConversationRead)
+async def get_conversation(conversation_id: int, fresh: bool = False):
+    if fresh:
+        await write_behind.last_message_at.flush_async(async_engine)
+    async with (async_engine.connect() if fresh else async_read_router.async_connect(conversation_id=conversation_id)) as conn:
+        query = tables.SELECT_CONVERSATION
+        row = (await conn.execute(query, {"cid": conversation_id})).mappings().first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return dict(row)
+
+
+@router.put("/conversations/{conversation_id}", response_model=ConversationRead)
+async def update_conversation(conversation_id: int, conv: ConversationCreate):
+    async with async_engine.connect() as conn:
+        previous_users = (await conn.execute(tables.SELECT_CONVERSATION_USERS, {"cid": conversation_id})).first()
+        stmt = tables.UPDATE_CONVERSATION
+        await conn.execute(stmt, {
+            "user_a_id": conv.user_a_id,
+            "user_b_id": conv.user_b_id,
+            "cid": conversation_id,
+        })
+        # 对话双方变了，重建收件箱行；留下来的用户保留已读水位，version 继续往上加
+        state = (await conn.execute(tables.SELECT_INBOX_STATE, {"cid": conversation_id})).all()
+        await conn.execute(tables.DELETE_INBOX, {"cid": conversation_id})
+        await conn.execute(tables.INSERT_INBOX, {"cid": conversation_id})
+        if state:
+            await conn.execute(tables.RESTORE_INBOX_STATE, [
+                {"cid": conversation_id, "uid": uid, "mid": mid, "prev_version": version}
+                for uid, mid, version in state
+            ])
+        await conn.commit()
+
+        row = (await conn.execute(
+            tables.SELECT_CONVERSATION,
+            {"cid": conversation_id},
+        )).mappings().first()
+
+    # 原来的双方和新的双方，GET /conversations 都按 user_id 路由
+    for user_id in set(previous_users or ()) | {conv.user_a_id, conv.user_b_id}:
+        async_read_router.note_write(user_id=user_id)
+    async_read_router.note_write(conversation_id=conversation_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="Conversation not found after update")
+    return dict(row)
+
+
+@router.delete("/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: int):
+    async with async_engine.connect() as conn:
+        users = (await conn.execute(tables.SELECT_CONVERSATION_USERS, {"cid": conversation_id})).first()
+        result = await conn.execute(
+            tables.DELETE_CONVERSATION,
+            {"cid": conversation_id},
+        )
+        await conn.commit()
+    for user_id in users or ():
+        async_read_router.note_write(user_id=user_id)
+    async_read_router.note_write(conversation_id=conversation_id)
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"deleted": True, "conversation_id": conversation_id}
+
+
+@router.post("/conversations/{conversation_id}/read")
+async def mark_conversation_read(
+    conversation_id: int,
+    message_id: Optional[int] = None,
+    user: Dict[str, Any] = Depends(verify_token_async),
+):
+    user_id = user["user_id"]
+    async with async_engine.begin() as conn:
+        latest = (await conn.execute(tables.SELECT_LATEST_MESSAGE_ID, {"cid": conversation_id})).scalar() or 0
+        read_up_to = latest if message_id is None else min(message_id, latest)
+        await conn.execute(tables.MARK_READ, {"uid": user_id, "cid": conversation_id, "mid": read_up_to})
+        row = (await conn.execute(
+            tables.SELECT_INBOX_ROW, {"uid": user_id, "cid": conversation_id}
+        )).mappings().first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    async_read_router.note_write(user_id=user_id, conversation_id=conversation_id)
+    return dict(row)
+
+
+# ============================================================
+# Messages Endpoints
+# ============================================================
+
+@router.get("/conversations/{conversation_id}/messages", response_model=List[MessageRead])
+async def list_messages(
+    conversation_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+):
+    # 本 worker 还有没写入的 version 更新时先 flush，否则会对刚发的消息回 304
+    if write_behind.last_message_at.has_pending(conversation_id):
+        await write_behind.last_message_at.flush_async(async_engine)
+    async with async_read_router.async_connect(conversation_id=conversation_id) as conn:
+        version = (await conn.execute(tables.SELECT_CONVERSATION_VERSION, {"cid": conversation_id})).first()
+        if version is not None:
+            headers = {
+                "ETag": etags.make_etag("messages", conversation_id, version.created_at, version.version),
+                "Last-Modified": etags.http_date(version.updated_at),
+                "Cache-Control": etags.PRIVATE_REVALIDATE,
+            }
+            if etags.matches(if_none_match, headers["ETag"]):
+                return etags.not_modified(headers)
+            response.headers.update(headers)
+        result = await conn.execute(
+            tables.LIST_MESSAGES,
+            {"cid": conversation_id},
+        )
+        rows = [dict(row._mapping) for row in result]
+    return rows
+
+
+async def insert_message(values):
+    """
+    Touch the conversation and insert one message in its own transaction;
+    returns message_id, or None when the conversation does not exist.
+    """
+    async with async_engine.begin() as conn:
+        if write_behind.LAST_MESSAGE_WRITE_BEHIND:
+            # last_message_at 交给后台 flusher 批量更新，这里不锁对话行；
+            # INSERT ... SELECT 在对话不存在时插入 0 行
+            result = await conn.execute(tables.INSERT_MESSAGE, values)
+            if result.rowcount == 0:
+                return None
+        else:
+            touched = await conn.execute(
+                tables.BUMP_LAST_MESSAGE_AT,
+                {"cid": values["conversation_id"], "last_message_at": values["created_at"]},
+            )
+            if touched.rowcount == 0:
+                return None
+            result = await conn.execute(tables.INSERT_MESSAGE, values)
+            await conn.execute(tables.BUMP_INBOX, {
+                "cid": values["conversation_id"],
+                "last_message_at": values["created_at"],
+                "snippet": tables.message_snippet(values["body"]),
+            })
+    return result.lastrowid
+
+
+@router.post("/messages", response_model=MessageRead)
+async def create_message(msg: MessageCreate):
+    # 一个事务完成：更新对话时间 + 插入消息，响应直接由写入的值构造，不再回读
+    values = {
+        "conversation_id": msg.conversation_id,
+        "sender_id": msg.sender_id,
+        "message_type": msg.message_type,
+        "body": msg.body,
+        "attachment_url": msg.attachment_url,
+        "created_at": tables.db_now(),
+    }
+    try:
+        if group_commit.MESSAGE_GROUP_COMMIT:
+            # 并发的消息合并成一个事务、一条多行 INSERT 写入
+            message_id = await group_commit.messages.submit_async(async_engine, values)
+        else:
+            message_id = await insert_message(values)
+    except IntegrityError as e:
+        # 对话是否存在已经单独查过，这里是其他约束（例如 sender_id 不是用户），三种写入模式一样处理
+        log_event("message.rejected", logging.WARNING, conversation_id=msg.conversation_id,
+                  sender_id=msg.sender_id, error=str(e.orig))
+        raise HTTPException(status_code=422, detail="Message violates a database constraint")
+    if message_id is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    if write_behind.LAST_MESSAGE_WRITE_BEHIND:
+        write_behind.last_message_at.add(msg.conversation_id, values["created_at"])
+    async_read_router.note_write(user_id=msg.sender_id, conversation_id=msg.conversation_id, message_id=message_id)
+    return {"message_id": message_id, **values}
+
+
+@router.get("/messages/{message_id}", response_model=MessageRead)
+async def get_message(
+    message_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None)
+):
+    # ETag 里带着 conversation_id / edit_version：先只查对话这一行，没变就 304，不读 Messages
+    conversation_id = etags.message_etag_conversation(if_none_match)
+    if conversation_id is not None:
+        async with async_read_router.async_connect(conversation_id=conversation_id) as conn:
+            version = (await conn.execute(tables.SELECT_CONVERSATION_VERSION, {"cid": conversation_id})).first()
+        if version is not None:
+            etag_value = etags.message_etag(message_id, conversation_id, version.created_at, version.edit_version)
+            if etags.matches(if_none_match, etag_value):
+                return etags.not_modified({"ETag": etag_value, "Cache-Control": etags.message_cache_control()})
+
+    async with async_read_router.async_connect(message_id=message_id) as conn:
+        row = (await conn.execute(tables.SELECT_MESSAGE_VERSIONED, {"mid": message_id})).mappings().first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Message not found")
+
+    message_dict = dict(row)
+    etag_value = etags.message_etag(
+        message_id,
+        message_dict["conversation_id"],
+        message_dict.pop("conversation_created_at"),
+        message_dict.pop("conversation_edit_version"),
+    )
+    headers = {"ETag": etag_value, "Cache-Control": etags.message_cache_control()}
+    if etags.matches(if_none_match, etag_value):
+        return etags.not_modified(headers)
+
+    response.headers.update(headers)
+    return message_dict
+
+
+@router.put("/messages/{message_id}", response_model=MessageRead)
+async def update_message(message_id: int, msg: MessageCreate):
+    async with async_engine.connect() as conn:
+        stmt = tables.UPDATE_MESSAGE
+        await conn.execute(stmt, {
+            "body": msg.body,
+            "message_type": msg.message_type,
+            "attachment_url": msg.attachment_url,
+            "mid": message_id,
+        })
+        row = (await conn.execute(
+            tables.SELECT_MESSAGE,
+            {"mid": message_id},
+        )).mappings().first()
+        if row:
+            await conn.execute(tables.REFRESH_INBOX_SNIPPET, {"cid": row["conversation_id"]})
+            await conn.execute(
+                tables.BUMP_CONVERSATION_VERSION, {"cid": row["conversation_id"], "updated_at": tables.db_now()}
+            )
+        await conn.commit()
+
+    if not row:
+        raise HTTPException(status_code=404, detail="Message not found after update")
+    # UPDATE 不改 conversation_id，请求体里的值可能指向别的对话
+    async_read_router.note_write(user_id=msg.sender_id, conversation_id=row["conversation_id"], message_id=message_id)
+    return dict(row)
+
+
+@router.delete("/messages/{message_id}")
+async def delete_message(message_id: int):
+    async with async_engine.connect() as conn:
+        row = (await conn.execute(tables.SELECT_MESSAGE, {"mid": message_id})).mappings().first()
+        result = await conn.execute(
+            tables.DELETE_MESSAGE,
+            {"mid": message_id},
+        )
+        if row:
+            await conn.execute(tables.REFRESH_INBOX_SNIPPET, {"cid": row["conversation_id"]})
+            await conn.execute(
+                tables.BUMP_CONVERSATION_VERSION, {"cid": row["conversation_id"], "updated_at": tables.db_now()}
+            )
+        await conn.commit()
+    if row:
+        async_read_router.note_write(conversation_id=row["conversation_id"], message_id=message_id)
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return {"deleted": True, "message_id": message_id}
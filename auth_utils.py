@@ -1,48 +1,543 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
 import requests
+from jose import jwt, JWTError
+import httpx
 from fastapi import HTTPException, status, Security
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
+import http_client
+from log_utils import log_event
+
 # 定义安全模式，这将使 Swagger UI 出现 "Authorize" 按钮
 security = HTTPBearer()
 
 SECURITY_SERVICE_URL = "http://34.74.164.213:8001/security/decode"
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)):
+# 已验证 Token 的本地缓存配置
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_MAXSIZE = int(os.getenv("AUTH_CACHE_MAXSIZE", "1024"))
+# 被拒绝的 Token 在本地记录一段时间，避免重复请求 Security Service
+AUTH_NEGATIVE_TTL = float(os.getenv("AUTH_NEGATIVE_TTL", "10"))
+AUTH_NEGATIVE_MAXSIZE = int(os.getenv("AUTH_NEGATIVE_MAXSIZE", "4096"))
+# 熔断打开时，过期不超过 AUTH_GRACE_SECONDS 的缓存仍然可用（默认关闭）
+AUTH_GRACE_SECONDS = float(os.getenv("AUTH_GRACE_SECONDS", "0"))
+
+# Security Service 熔断配置
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+
+# AUTH_MODE=local 时在本地校验签名，公钥从 Security Service 的 JWKS 获取
+AUTH_MODE = os.getenv("AUTH_MODE", "remote")
+SECURITY_JWKS_URL = os.getenv(
+    "SECURITY_JWKS_URL", SECURITY_SERVICE_URL.rsplit("/", 1)[0] + "/jwks"
+)
+AUTH_JWKS_REFRESH = float(os.getenv("AUTH_JWKS_REFRESH", "300"))
+AUTH_ALGORITHMS = os.getenv("AUTH_ALGORITHMS", "RS256").split(",")
+
+
+class TTLCache:
     """
-    验证 Token。
-    FastAPI 的 HTTPBearer 会自动确保 Header 存在且格式为 "Bearer <token>"。
-    credentials.credentials 就是纯 Token 字符串，没有 Bearer 前缀。
+    Thread-safe LRU cache whose entries expire after a per-entry TTL.
+    An entry may also carry a longer stale deadline, readable only
+    through get_stale().
     """
-    token = credentials.credentials
 
-    if not token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing token",
-            headers={"WWW-Authenticate": "Bearer"},
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key, now):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._lookup(key, now)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def get_stale(self, key):
+        with self._lock:
+            entry = self._lookup(key, time.monotonic())
+            if entry is None:
+                return None
+            self.stale_hits += 1
+            return entry[2]
+
+    def set(self, key, value, ttl: float = None, stale_ttl: float = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        stale_ttl = ttl if stale_ttl is None else max(ttl, stale_ttl)
+        if stale_ttl <= 0 or self.maxsize <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (now + ttl, now + stale_ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.stale_hits = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+            }
+
+
+token_cache = TTLCache(AUTH_CACHE_MAXSIZE, AUTH_CACHE_TTL)
+# 只保存 Token 哈希；超过上限时淘汰最久未使用的记录
+rejected_tokens = TTLCache(AUTH_NEGATIVE_MAXSIZE, AUTH_NEGATIVE_TTL)
+
+
+class CircuitBreaker:
+    """
+    Opens when the error rate over the last `window` calls reaches
+    `error_rate`, rejects calls for `open_seconds`, then lets a single
+    half-open probe through: success closes it, failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, window: int, min_calls: int, error_rate: float, open_seconds: float):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self._results = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if now - self._opened_at < self.open_seconds:
+                    return False
+                self.state = self.HALF_OPEN
+            elif now - self._probe_started < self.open_seconds:
+                # 已有探测请求在进行中
+                return False
+            self._probe_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                self._results.clear()
+            self._results.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._open()
+                return
+            self._results.append(False)
+            failures = self._results.count(False)
+            if (
+                len(self._results) >= self.min_calls
+                and failures / len(self._results) >= self.error_rate
+            ):
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._results.clear()
+
+
+breaker = CircuitBreaker(
+    BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_ERROR_RATE, BREAKER_OPEN_SECONDS
+)
+
+
+class KeySet:
+    """
+    JWKS public keys indexed by kid.
+    Fetched once on first use, then refreshed by a background daemon thread.
+    """
+
+    def __init__(self, url: str, refresh_interval: float):
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def refresh(self):
+        try:
+            response = http_client.session.get(self.url, timeout=http_client.TIMEOUT)
+            response.raise_for_status()
+            body = response.json()
+            # 响应不是 {"keys": [...]} 时按刷新失败处理，不能让后台线程退出
+            if not isinstance(body, dict) or not isinstance(body.get("keys", []), list):
+                raise ValueError("JWKS response is not a key set")
+            keys = {k["kid"]: k for k in body.get("keys", []) if isinstance(k, dict) and "kid" in k}
+        except (requests.RequestException, ValueError, KeyError) as e:
+            # 刷新失败时保留旧的公钥
+            log_event("auth.jwks_refresh_failed", logging.WARNING, url=self.url, error=str(e))
+            return
+        self._keys = keys
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            self.refresh()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.refresh()
+            self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+            self._thread.start()
+
+    def started(self) -> bool:
+        return self._thread is not None
+
+    def get(self, kid):
+        self.start()
+        return self._keys.get(kid)
+
+
+jwks = KeySet(SECURITY_JWKS_URL, AUTH_JWKS_REFRESH)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs
+    fn, the others block until it finishes and share its result or error.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines running on one event loop. If the leader
+    is cancelled (its client disconnected), waiting callers are not: one
+    of them becomes the new leader and runs fn again.
+    """
+
+    _LEADER_CANCELLED = object()
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            result = await asyncio.shield(future)
+            if result is not self._LEADER_CANCELLED:
+                return result
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # 只有 leader 自己被取消；等待者醒来后重新选 leader
+            future.set_result(self._LEADER_CANCELLED)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有等待者时避免 "never retrieved" 警告
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+
+# 同一个 Token 同时只向 Security Service 发送一次请求
+inflight = SingleFlight()
+inflight_async = AsyncSingleFlight()
+
+
+def token_key(token: str) -> str:
+    """缓存键只保存 Token 的哈希，不保存原始 Token。"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def unverified_claims(token: str) -> dict:
+    """
+    读取 JWT payload 而不校验签名，只用于计算缓存过期时间。
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+    except (IndexError, ValueError):
+        return {}
+    return claims if isinstance(claims, dict) else {}
+
+
+def token_lifetime(token: str, identity: dict) -> float:
+    """距离 Token 的 exp 还剩多少秒；没有 exp 时为无穷大。"""
+    exp = identity.get("exp") or unverified_claims(token).get("exp")
+    if not isinstance(exp, (int, float)):
+        return float("inf")
+    return exp - time.time()
+
+
+def cache_identity(token: str, key: str, identity: dict):
+    """缓存时间和宽限时间都不超过 Token 的 exp。"""
+    lifetime = token_lifetime(token, identity)
+    ttl = min(AUTH_CACHE_TTL, lifetime)
+    token_cache.set(key, identity, ttl, min(ttl + AUTH_GRACE_SECONDS, lifetime))
+
+
+def security_unavailable():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Security Service unavailable"
+    )
+
+
+def invalid_token():
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid or expired token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def decode_local(token: str):
+    """
+    用缓存的 JWKS 公钥在本地校验签名和过期时间。
+    kid 未知时返回 None，由调用方回退到远程校验。
+    """
+    try:
+        header = jwt.get_unverified_header(token)
+    except JWTError:
+        raise invalid_token()
+
+    key = jwks.get(header.get("kid"))
+    if key is None:
+        return None
+
+    try:
+        claims = jwt.decode(
+            token, key, algorithms=AUTH_ALGORITHMS, options={"verify_aud": False}
         )
+    except JWTError:
+        raise invalid_token()
+
+    if "user_id" not in claims and "sub" in claims:
+        claims["user_id"] = int(claims["sub"]) if str(claims["sub"]).isdigit() else claims["sub"]
+    return claims
+
+
+def check_remote_response(response):
+    """根据 Security Service 的响应更新熔断器并返回用户信息。"""
+    if response.status_code >= 500:
+        breaker.record_failure()
+        raise security_unavailable()
+
+    breaker.record_success()
+    if response.status_code != 200:
+        raise invalid_token()
+
+    # 返回用户信息: { "user_id": 11, "role": "admin" }
+    return response.json()
+
+
+def decode_remote(token: str):
+    """调用 Security Service 解码 Token。熔断打开时直接返回 503。"""
+    if not breaker.allow():
+        raise security_unavailable()
 
-    # 调用 Security Service
     try:
-        response = requests.post(
-            SECURITY_SERVICE_URL, 
-            json={"token": token}, 
-            timeout=5
+        response = http_client.session.post(
+            SECURITY_SERVICE_URL,
+            json={"token": token},
+            timeout=http_client.TIMEOUT
         )
     except requests.RequestException:
         # 捕获网络连接、超时等错误
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Security Service unavailable"
+        breaker.record_failure()
+        raise security_unavailable()
+
+    return check_remote_response(response)
+
+
+async def decode_remote_async(token: str):
+    """decode_remote 的异步版本，使用 httpx 非阻塞请求。"""
+    if not breaker.allow():
+        raise security_unavailable()
+
+    try:
+        response = await http_client.async_client.post(
+            SECURITY_SERVICE_URL, json={"token": token}
         )
+    except httpx.HTTPError:
+        breaker.record_failure()
+        raise security_unavailable()
 
-    if response.status_code != 200:
+    return check_remote_response(response)
+
+
+def handle_failure(key: str, error: HTTPException):
+    """
+    被拒绝的 Token 记入 rejected_tokens；
+    Security Service 不可用时，使用宽限期内的缓存结果。
+    """
+    if error.status_code == status.HTTP_401_UNAUTHORIZED:
+        rejected_tokens.set(key, True)
+    elif error.status_code == status.HTTP_503_SERVICE_UNAVAILABLE:
+        stale = token_cache.get_stale(key)
+        if stale is not None:
+            return stale
+    raise error
+
+
+def require_token(credentials: HTTPAuthorizationCredentials) -> str:
+    token = credentials.credentials
+
+    if not token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired token",
+            detail="Missing token",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    return token
 
-    # 返回用户信息: { "user_id": 11, "role": "admin" }
-    print(response.json())
-    return response.json()
\ No newline at end of file
+
+def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)):
+    """
+    验证 Token。
+    FastAPI 的 HTTPBearer 会自动确保 Header 存在且格式为 "Bearer <token>"。
+    credentials.credentials 就是纯 Token 字符串，没有 Bearer 前缀。
+    """
+    token = require_token(credentials)
+
+    key = token_key(token)
+    cached = token_cache.get(key)
+    if cached is not None:
+        return cached
+    if rejected_tokens.get(key) is not None:
+        raise invalid_token()
+
+    return inflight.do(key, lambda: resolve_token(token, key))
+
+
+def resolve_token(token: str, key: str):
+    try:
+        identity = decode_local(token) if AUTH_MODE == "local" else None
+        if identity is None:
+            identity = decode_remote(token)
+    except HTTPException as e:
+        return handle_failure(key, e)
+
+    log_event("auth.verified", logging.DEBUG, user_id=identity.get("user_id"), role=identity.get("role"))
+    cache_identity(token, key, identity)
+    return identity
+
+
+async def verify_token_async(credentials: HTTPAuthorizationCredentials = Security(security)):
+    """
+    verify_token 的异步版本。
+    FastAPI 在事件循环中直接运行它，等待 Security Service 时不占用线程池。
+    """
+    token = require_token(credentials)
+
+    key = token_key(token)
+    cached = token_cache.get(key)
+    if cached is not None:
+        return cached
+    if rejected_tokens.get(key) is not None:
+        raise invalid_token()
+
+    return await inflight_async.do(key, lambda: resolve_token_async(token, key))
+
+
+async def resolve_token_async(token: str, key: str):
+    try:
+        identity = None
+        if AUTH_MODE == "local":
+            if not jwks.started():
+                # 首次获取 JWKS 是阻塞请求，放到线程池执行
+                await run_in_threadpool(jwks.start)
+            identity = decode_local(token)
+        if identity is None:
+            identity = await decode_remote_async(token)
+    except HTTPException as e:
+        return handle_failure(key, e)
+
+    log_event("auth.verified", logging.DEBUG, user_id=identity.get("user_id"), role=identity.get("role"))
+    cache_identity(token, key, identity)
+    return identity
@@ -0,0 +1,81 @@
+"""
+Throughput of the sync (threadpool) and async (asyncmy) endpoint modes.
+
+Each mode runs in its own process, since DB_ASYNC is read at import time.
+Requests go straight to the ASGI app, so the numbers reflect handler and
+database cost rather than HTTP parsing. Uses DATABASE_URL (or the DB_*
+settings from .env); a SQLite database is migrated and seeded first.
+Async mode on SQLite needs aiosqlite.
+
+    python benchmarks/bench_db_modes.py [conversation_id] [requests] [concurrency]
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def run_mode(conversation_id, total, concurrency):
+    import httpx
+
+    sys.path.insert(0, ROOT)
+    from main import app
+
+    paths = [
+        f"/conversations/{conversation_id}",
+        f"/conversations/{conversation_id}/messages",
+    ]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://bench"
+    ) as client:
+
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(paths[i % len(paths)])
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    mode = "async" if os.getenv("DB_ASYNC") == "1" else "sync"
+    print(
+        f"{mode:<6} {total / elapsed:8.1f} req/s"
+        f"  p50 {latencies[len(latencies) // 2] * 1e3:7.2f} ms"
+        f"  p99 {latencies[int(len(latencies) * 0.99) - 1] * 1e3:7.2f} ms"
+    )
+
+
+def main():
+    args = sys.argv[1:] or ["1"]
+    conversation_id = int(args[0])
+    total = int(args[1]) if len(args) > 1 else 2000
+    concurrency = int(args[2]) if len(args) > 2 else 100
+
+    if os.getenv("BENCH_CHILD"):
+        asyncio.run(run_mode(conversation_id, total, concurrency))
+        return
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from common import prepare_database
+    from database import engine
+
+    if engine.dialect.name == "sqlite":
+        prepare_database(engine)
+
+    for db_async in ("0", "1"):
+        env = dict(os.environ, DB_ASYNC=db_async, BENCH_CHILD="1", LOG_LEVEL="WARNING")
+        subprocess.run([sys.executable, __file__, *args], env=env, check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Message insert throughput with and without group commit, for N
+concurrent writers: sync rows call main.create_message (one thread each),
+async rows submit to the async writer task on an async engine (one
+coroutine each; SQLite needs aiosqlite).
+
+    DATABASE_URL=sqlite:////tmp/lionswap-bench.db python benchmarks/bench_group_commit.py [seconds]
+
+MESSAGE_GROUP_MAX_BATCH / MESSAGE_GROUP_MAX_WAIT_MS tune the batches.
+"""
+import asyncio
+import sys
+import threading
+import time
+
+from common import prepare_database
+
+import database  # noqa: E402
+import group_commit  # noqa: E402
+import main  # noqa: E402
+import tables  # noqa: E402
+from database import engine  # noqa: E402
+from models.message_models import MessageCreate  # noqa: E402
+
+CONCURRENCY = [1, 8, 32]
+
+
+def run(writers, seconds):
+    counts = [0] * writers
+    stop = time.perf_counter() + seconds
+
+    def writer(i):
+        n = 0
+        while time.perf_counter() < stop:
+            main.create_message(MessageCreate(
+                conversation_id=1 + (i * 31 + n) % 100, sender_id=1, body=f"bench {i}/{n}",
+            ))
+            n += 1
+        counts[i] = n
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+async def run_async(async_engine, writers, seconds, grouped):
+    counts = [0] * writers
+    stop = time.perf_counter() + seconds
+
+    async def writer(i):
+        n = 0
+        while time.perf_counter() < stop:
+            row = {
+                "conversation_id": 1 + (i * 31 + n) % 100,
+                "sender_id": 1,
+                "message_type": "TEXT",
+                "body": f"bench {i}/{n}",
+                "attachment_url": None,
+                "created_at": tables.db_now(),
+            }
+            if grouped:
+                await group_commit.messages.submit_async(async_engine, row)
+            else:
+                async with async_engine.begin() as conn:
+                    await conn.run_sync(group_commit.write_batch, [row])
+            n += 1
+        counts[i] = n
+
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(i) for i in range(writers)))
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def report(mode, writers, single, grouped, before, after):
+    batches = after["batches"] - before["batches"]
+    avg_batch = (after["rows"] - before["rows"]) / batches if batches else 0.0
+    print(f"{mode:>6} {writers:>8} {single:13.0f} {grouped:12.0f} {grouped / single:7.2f}x {avg_batch:10.1f}")
+
+
+async def async_rows(seconds):
+    async_engine = database.make_async_engine(database.async_url(str(engine.url)))
+    try:
+        for writers in CONCURRENCY:
+            single = await run_async(async_engine, writers, seconds, grouped=False)
+            before = group_commit.messages.stats()
+            grouped = await run_async(async_engine, writers, seconds, grouped=True)
+            report("async", writers, single, grouped, before, group_commit.messages.stats())
+    finally:
+        await async_engine.dispose()
+
+
+def main_():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    prepare_database(engine)
+    print(f"{'mode':>6} {'writers':>8} {'single msg/s':>13} {'group msg/s':>12} {'speedup':>8} {'avg batch':>10}")
+    for writers in CONCURRENCY:
+        group_commit.MESSAGE_GROUP_COMMIT = False
+        single = run(writers, seconds)
+        group_commit.MESSAGE_GROUP_COMMIT = True
+        before = group_commit.messages.stats()
+        grouped = run(writers, seconds)
+        report("sync", writers, single, grouped, before, group_commit.messages.stats())
+    asyncio.run(async_rows(seconds))
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,57 @@
+"""
+Per-request latency of one-off requests.post vs the pooled http_client.session
+against a local stub of the security service.
+
+    python benchmarks/bench_http_client.py [iterations]
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import http_client  # noqa: E402
+
+
+class StubSecurityHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"user_id": 11, "role": "user"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(label, post, url, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        post(url, json={"token": "x"}, timeout=http_client.TIMEOUT).json()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<16} {elapsed / iterations * 1e6:8.1f} us/request")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubSecurityHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/security/decode"
+
+    run("requests.post", requests.post, url, iterations)
+    run("pooled session", http_client.session.post, url, iterations)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
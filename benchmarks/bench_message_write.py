@@ -0,0 +1,90 @@
+"""
+POST /messages write path: the old insert+commit, touch+commit, re-SELECT
+sequence vs the single transaction in main.create_message. Reports
+latency per message and statements / commits per message.
+
+    DATABASE_URL=sqlite:////tmp/lionswap-bench.db python benchmarks/bench_message_write.py [messages]
+"""
+import statistics
+import sys
+import time
+
+from common import prepare_database
+
+from sqlalchemy import event  # noqa: E402
+
+import tables  # noqa: E402
+from database import engine  # noqa: E402
+from models.message_models import MessageCreate  # noqa: E402
+
+
+def old_write(msg):
+    with engine.connect() as conn:
+        result = conn.execute(tables.INSERT_MESSAGE, {
+            "conversation_id": msg.conversation_id,
+            "sender_id": msg.sender_id,
+            "message_type": msg.message_type,
+            "body": msg.body,
+            "attachment_url": msg.attachment_url,
+            "created_at": tables.db_now(),
+        })
+        conn.commit()
+        conn.execute(tables.BUMP_LAST_MESSAGE_AT, {"cid": msg.conversation_id, "last_message_at": tables.db_now()})
+        conn.commit()
+        return dict(conn.execute(tables.SELECT_MESSAGE, {"mid": result.lastrowid}).mappings().first())
+
+
+def new_write(msg):
+    import main
+    return main.create_message(msg)
+
+
+class Counter:
+    def __init__(self):
+        self.statements = 0
+        self.commits = 0
+        event.listen(engine, "before_cursor_execute", self.on_execute)
+        event.listen(engine, "commit", self.on_commit)
+
+    def on_execute(self, *args):
+        self.statements += 1
+
+    def on_commit(self, *args):
+        self.commits += 1
+
+    def reset(self):
+        self.statements = self.commits = 0
+
+
+def run(write, messages, counter):
+    counter.reset()
+    latencies = []
+    for n in range(messages):
+        msg = MessageCreate(
+            conversation_id=1 + n % 50, sender_id=1, message_type="TEXT", body=f"bench message {n}",
+        )
+        start = time.perf_counter()
+        write(msg)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return (
+        statistics.mean(latencies),
+        latencies[int(len(latencies) * 0.99) - 1],
+        counter.statements / messages,
+        counter.commits / messages,
+    )
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    prepare_database(engine)
+    counter = Counter()
+    print(f"{'path':<8} {'avg ms':>8} {'p99 ms':>8} {'stmts/msg':>10} {'commits/msg':>12}")
+    for name, write in (("old", old_write), ("new", new_write)):
+        run(write, 20, counter)
+        avg, p99, statements, commits = run(write, messages, counter)
+        print(f"{name:<8} {avg:8.3f} {p99:8.3f} {statements:10.1f} {commits:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Per-endpoint cost of the old inline text("SELECT * ...") queries vs the
+prebuilt Core statements in tables.py: CPU time per request (statement
+build + execute + row -> dict) and bytes of column data fetched.
+
+    DATABASE_URL=sqlite:////tmp/lionswap-bench.db python benchmarks/bench_statements.py [iterations]
+"""
+import sys
+import time
+
+from common import prepare_database
+
+from sqlalchemy import text  # noqa: E402
+
+import tables  # noqa: E402
+from database import engine  # noqa: E402
+
+USER_CONVERSATIONS_SQL = """
+    SELECT c.*,
+           ua.student_name as user_a_name, ua.uni as user_a_uni,
+           ub.student_name as user_b_name, ub.uni as user_b_uni
+    FROM Conversations c
+    LEFT JOIN Users ua ON c.user_a_id = ua.user_id
+    LEFT JOIN Users ub ON c.user_b_id = ub.user_id
+    WHERE c.user_a_id=:uid OR c.user_b_id=:uid
+"""
+
+# endpoint -> (old statement factory, new statement, params)
+CASES = {
+    "GET /conversations": (
+        lambda: text(USER_CONVERSATIONS_SQL), tables.LIST_USER_CONVERSATIONS, {"uid": 1},
+    ),
+    "GET /conversations/{id}": (
+        lambda: text("SELECT * FROM Conversations WHERE conversation_id = :cid"),
+        tables.SELECT_CONVERSATION, {"cid": 1},
+    ),
+    "GET /conversations/{id}/messages": (
+        lambda: text("SELECT * FROM Messages WHERE conversation_id = :cid ORDER BY created_at ASC"),
+        tables.LIST_MESSAGES, {"cid": 1},
+    ),
+    "GET /messages/{id}": (
+        lambda: text("SELECT * FROM Messages WHERE message_id = :mid"),
+        tables.SELECT_MESSAGE, {"mid": 1},
+    ),
+}
+
+
+def run(conn, make_stmt, params, iterations):
+    fetched = 0
+    start = time.process_time()
+    for _ in range(iterations):
+        rows = [dict(row._mapping) for row in conn.execute(make_stmt(), params)]
+        fetched = sum(len(str(v)) for row in rows for v in row.values() if v is not None)
+    return (time.process_time() - start) / iterations * 1e6, fetched
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    prepare_database(engine)
+    with engine.connect() as conn:
+        print(f"{'endpoint':<34} {'old us/req':>11} {'new us/req':>11} {'old bytes':>10} {'new bytes':>10}")
+        for name, (old, new, params) in CASES.items():
+            old_cpu, old_bytes = run(conn, old, params, iterations)
+            new_cpu, new_bytes = run(conn, lambda: new, params, iterations)
+            print(f"{name:<34} {old_cpu:11.1f} {new_cpu:11.1f} {old_bytes:10d} {new_bytes:10d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Shared setup for the benchmarks: run them hermetically on SQLite with
+
+    DATABASE_URL=sqlite:////tmp/lionswap-bench.db python benchmarks/<bench>.py
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import text  # noqa: E402
+
+
+def prepare_database(engine, users=200, conversations=500, messages_per_conversation=40):
+    """Apply migrations and, if the database is empty, fill it with synthetic chats."""
+    import migrate
+    from migrations import v004_user_inbox as inbox
+
+    with engine.begin() as conn:
+        migrate.upgrade_conn(conn)
+        if conn.execute(text("SELECT COUNT(*) FROM Conversations")).scalar():
+            return
+
+        conn.execute(
+            text("INSERT INTO Users (user_id, uni, student_name, email) VALUES (:uid, :uni, :name, :email)"),
+            [
+                {"uid": uid, "uni": f"bn{uid}", "name": f"Student {uid}", "email": f"bn{uid}@columbia.edu"}
+                for uid in range(1, users + 1)
+            ],
+        )
+        pairs = sorted({
+            tuple(sorted((1 + i % users, 1 + (i * 7 + 3) % users)))
+            for i in range(conversations)
+        })
+        conn.execute(
+            text("INSERT INTO Conversations (user_a_id, user_b_id) VALUES (:a, :b)"),
+            [{"a": a, "b": b} for a, b in pairs if a != b],
+        )
+        rows = conn.execute(text("SELECT conversation_id, user_a_id, user_b_id FROM Conversations")).all()
+        conn.execute(
+            text("""
+                INSERT INTO Messages (conversation_id, sender_id, message_type, body)
+                VALUES (:cid, :sender, 'TEXT', :body)
+            """),
+            [
+                {"cid": cid, "sender": (a, b)[n % 2], "body": f"message {n} in conversation {cid}"}
+                for cid, a, b in rows
+                for n in range(messages_per_conversation)
+            ],
+        )
+        conn.execute(text("UPDATE Conversations SET last_message_at = CURRENT_TIMESTAMP"))
+        inbox.backfill(conn)
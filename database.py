@@ -1,6 +1,19 @@
+import itertools
+import logging
 import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
+
+from log_utils import log_event
 
 load_dotenv()
 
@@ -10,6 +23,288 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 
-DATABASE_URL = f"mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# DATABASE_URL 可以覆盖默认的 MySQL 连接，例如 sqlite:///lionswap.db 或 sqlite:///:memory:
+DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    f"mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}",
+)
+
+# 连接池配置，按 worker 数量调整
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# 启动时预先建立的连接数
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", str(DB_POOL_SIZE)))
+
+# 只读副本，逗号分隔的完整 URL；为空时所有读写都走主库
+DB_REPLICA_URLS = [u.strip() for u in os.getenv("DB_REPLICA_URLS", "").split(",") if u.strip()]
+# 写入后这段时间内，该用户 / 对话的读请求走主库（read-your-writes）
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+# 副本连接失败后，暂停使用它的时间
+DB_REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+
+
+class PoolStats:
+    """Checkout wait times and connect rate for one pool."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.connects = 0
+        self._recent_connects = deque(maxlen=10000)
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+            self._recent_connects.append(time.monotonic())
+
+    def snapshot(self, pool) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            recent = sum(1 for t in self._recent_connects if now - t <= 60)
+            return {
+                "size": pool.size() if hasattr(pool, "size") else None,
+                "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+                "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+                "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+                "checkouts": self.checkouts,
+                "avg_checkout_wait_ms": self.wait_total / self.checkouts * 1000 if self.checkouts else 0.0,
+                "max_checkout_wait_ms": self.wait_max * 1000,
+                "connects": self.connects,
+                "connects_per_sec": recent / 60,
+            }
+
+
+class TimedPoolMixin:
+    """Measures how long each checkout waits for a free connection."""
+
+    stats: PoolStats
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.stats.record_wait(time.perf_counter() - start)
+
+
+def timed_pool_class(base):
+    """
+    Pool class with its own PoolStats. Stats live on the class so they
+    survive pool.recreate() (engine.dispose(), invalidation).
+    """
+    return type(f"Timed{base.__name__}", (TimedPoolMixin, base), {"stats": PoolStats()})
+
+
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+
+def is_memory_sqlite(url) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def engine_options(url, pool_base) -> dict:
+    """
+    Pool settings for a URL. In-memory SQLite gets a single shared
+    connection (StaticPool), otherwise each connection would see its own
+    empty database.
+    """
+    options = {"echo": False}
+    if make_url(url).get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+    if is_memory_sqlite(url):
+        options["poolclass"] = timed_pool_class(StaticPool)
+    else:
+        options["poolclass"] = timed_pool_class(pool_base)
+        options.update(POOL_OPTIONS)
+    return options
+
+
+def on_connect(sync_engine):
+    """
+    Counts new connections; on SQLite also turns on foreign keys, on MySQL
+    pins the session time zone to UTC.
+    """
+    dialect = sync_engine.dialect.name
+
+    def connect(dbapi_conn, record):
+        sync_engine.pool.stats.record_connect()
+        if dialect == "sqlite":
+            # SQLite 默认不检查外键，打开后 ON DELETE CASCADE 和 MySQL 行为一致
+            cursor = dbapi_conn.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+        elif dialect == "mysql":
+            # 服务写入的时间都是 UTC（tables.db_now），NOW() / 列默认值也要按 UTC 算
+            cursor = dbapi_conn.cursor()
+            cursor.execute("SET time_zone = '+00:00'")
+            cursor.close()
+
+    event.listen(sync_engine, "connect", connect)
+
+
+def make_engine(url):
+    new_engine = create_engine(url, **engine_options(url, QueuePool))
+    on_connect(new_engine)
+    return new_engine
+
+
+def make_async_engine(url):
+    new_engine = create_async_engine(url, **engine_options(url, AsyncAdaptedQueuePool))
+    on_connect(new_engine.sync_engine)
+    return new_engine
+
+
+class ReadRouter:
+    """
+    Sends reads to a healthy replica (round robin) and everything else to
+    the primary. Reads for a user or conversation that wrote within the
+    last READ_YOUR_WRITES_SECONDS go to the primary, as do all reads when
+    no replica can be reached. Write tracking is per process.
+    """
+
+    MAX_TRACKED_WRITES = 10000
+
+    def __init__(self, primary, replicas):
+        self.primary = primary
+        self.replicas = replicas
+        self._down_until = {}
+        self._writes = {}
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    def note_write(self, user_id=None, conversation_id=None, message_id=None):
+        if not self.replicas:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._writes) >= self.MAX_TRACKED_WRITES:
+                self._writes = {k: t for k, t in self._writes.items() if t > now}
+            for key in (("user", user_id), ("conversation", conversation_id), ("message", message_id)):
+                if key[1] is not None:
+                    self._writes[key] = now + READ_YOUR_WRITES_SECONDS
+
+    def _recently_wrote(self, user_id, conversation_id, message_id, now):
+        with self._lock:
+            return any(
+                self._writes.get(key, 0) > now
+                for key in (("user", user_id), ("conversation", conversation_id), ("message", message_id))
+            )
+
+    def candidates(self, user_id=None, conversation_id=None, message_id=None):
+        """Engines to try for a read, in order; the primary is always last."""
+        now = time.monotonic()
+        if not self.replicas or self._recently_wrote(user_id, conversation_id, message_id, now):
+            return [self.primary]
+        healthy = [r for r in self.replicas if self._down_until.get(r, 0) <= now]
+        if healthy:
+            start = next(self._next) % len(healthy)
+            healthy = healthy[start:] + healthy[:start]
+        return healthy + [self.primary]
+
+    def mark_down(self, replica, error):
+        self._down_until[replica] = time.monotonic() + DB_REPLICA_RETRY_SECONDS
+        log_event("db.replica_down", logging.WARNING, replica=replica.url.host, error=str(error))
+
+    @contextmanager
+    def connect(self, user_id=None, conversation_id=None, message_id=None):
+        for candidate in self.candidates(user_id, conversation_id, message_id):
+            try:
+                conn = candidate.connect()
+            except DBAPIError as e:
+                if candidate is self.primary:
+                    raise
+                self.mark_down(candidate, e)
+                continue
+            with conn:
+                yield conn
+            return
+
+    @asynccontextmanager
+    async def async_connect(self, user_id=None, conversation_id=None, message_id=None):
+        for candidate in self.candidates(user_id, conversation_id, message_id):
+            try:
+                conn = await candidate.connect()
+            except DBAPIError as e:
+                if candidate is self.primary:
+                    raise
+                self.mark_down(candidate, e)
+                continue
+            try:
+                yield conn
+            finally:
+                await conn.close()
+            return
+
+
+# 启动时自动执行 migrations；内存 SQLite 默认打开，否则每次启动都是空库
+DB_AUTO_MIGRATE = os.getenv(
+    "DB_AUTO_MIGRATE", "1" if is_memory_sqlite(DATABASE_URL) else "0"
+) == "1"
+
+engine = make_engine(DATABASE_URL)
+replica_engines = [make_engine(url) for url in DB_REPLICA_URLS]
+read_router = ReadRouter(engine, replica_engines)
+
+# DB_ASYNC=1 时 main.py 使用 async 版本的接口（MySQL: asyncmy，SQLite: aiosqlite）
+DB_ASYNC = os.getenv("DB_ASYNC", "0") == "1"
+ASYNC_DRIVERS = {"mysql": "mysql+asyncmy", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_url(DATABASE_URL)
+
+async_engine = None
+async_read_router = None
+if DB_ASYNC:
+    async_engine = make_async_engine(ASYNC_DATABASE_URL)
+    async_read_router = ReadRouter(
+        async_engine, [make_async_engine(async_url(url)) for url in DB_REPLICA_URLS]
+    )
+
+
+def warm_pool(n: int = DB_POOL_WARM):
+    """Open n connections up front so the first requests don't pay for connects."""
+    conns = [engine.connect() for _ in range(min(n, DB_POOL_SIZE))]
+    for conn in conns:
+        conn.close()
+
+
+async def warm_async_pool(n: int = DB_POOL_WARM):
+    conns = [await async_engine.connect() for _ in range(min(n, DB_POOL_SIZE))]
+    for conn in conns:
+        await conn.close()
+
 
-engine = create_engine(DATABASE_URL, echo=False)
\ No newline at end of file
+def pool_stats() -> dict:
+    stats = {"sync": engine.pool.stats.snapshot(engine.pool)}
+    for i, replica in enumerate(replica_engines):
+        stats[f"sync_replica_{i}"] = replica.pool.stats.snapshot(replica.pool)
+    if async_engine is not None:
+        pool = async_engine.sync_engine.pool
+        stats["async"] = pool.stats.snapshot(pool)
+        for i, replica in enumerate(async_read_router.replicas):
+            pool = replica.sync_engine.pool
+            stats[f"async_replica_{i}"] = pool.stats.snapshot(pool)
+    return stats
@@ -0,0 +1,85 @@
+"""
+Conditional GET helpers.
+
+Validators are built from a cheap version read (not from the response
+body) and hashed with sha1, so every worker computes the same ETag for the
+same state and a matching If-None-Match is answered with 304 before the
+full query runs.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime
+
+from fastapi import Response
+
+# 客户端每次都要带 If-None-Match 回来验证，不允许共享缓存存按用户区分的响应
+PRIVATE_REVALIDATE = "private, no-cache"
+# 消息可以被 PUT / DELETE 修改，默认每次都验证；不允许编辑的部署可以让客户端缓存 N 秒
+MESSAGE_CACHE_MAX_AGE = int(os.getenv("MESSAGE_CACHE_MAX_AGE", "0"))
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def make_etag(*parts) -> str:
+    """Weak ETag over the given version parts (ints, strings, datetimes, None)."""
+    raw = json.dumps(parts, default=_default, separators=(",", ":"))
+    return f'W/"{hashlib.sha1(raw.encode()).hexdigest()[:20]}"'
+
+
+def message_etag(message_id: int, conversation_id: int, created_at, edit_version: int) -> str:
+    """
+    ETag of one message: "<conversation_id>.<edit_version>.<digest>". The
+    conversation's edit_version changes on every edit / delete of its
+    messages (new messages leave it alone), so a validator can be
+    re-checked from the Conversations row alone.
+    """
+    raw = json.dumps(["message", message_id, conversation_id, created_at, edit_version], default=_default)
+    return f'W/"{conversation_id}.{edit_version}.{hashlib.sha1(raw.encode()).hexdigest()[:20]}"'
+
+
+def message_cache_control() -> str:
+    if MESSAGE_CACHE_MAX_AGE > 0:
+        return f"private, max-age={MESSAGE_CACHE_MAX_AGE}"
+    return PRIVATE_REVALIDATE
+
+
+def message_etag_conversation(if_none_match):
+    """conversation_id named by the first message ETag in If-None-Match, or None."""
+    for tag in (if_none_match or "").split(","):
+        conversation_id, _, rest = _opaque(tag).strip('"').partition(".")
+        if rest and conversation_id.isdigit():
+            return int(conversation_id)
+    return None
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def matches(if_none_match, etag: str) -> bool:
+    """If-None-Match uses weak comparison; accepts a list of tags or *."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return _opaque(etag) in {_opaque(tag) for tag in if_none_match.split(",")}
+
+
+def http_date(value: datetime) -> str:
+    """
+    Last-Modified value for a naive UTC timestamp. Informational only: the
+    column has one-second precision, so two writes in the same second share
+    it and If-Modified-Since is not used to answer 304 (the ETag is).
+    """
+    return format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,46 @@
+"""
+NDJSON export of the admin conversation listing.
+
+Rows are read with stream_results / yield_per and written out one chunk
+at a time, so memory stays at EXPORT_CHUNK_ROWS rows whatever the table
+size. Drivers without server-side cursors (mysql-connector, pysqlite)
+still fetch in chunks from an unbuffered cursor.
+"""
+import json
+import os
+from datetime import datetime
+
+import tables
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "500"))
+NDJSON = "application/x-ndjson"
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def to_ndjson(rows) -> str:
+    return "".join(json.dumps(dict(row._mapping), default=_default) + "\n" for row in rows)
+
+
+def stream_conversations(connect):
+    """Yields NDJSON chunks; `connect` is a context manager giving a sync connection."""
+    with connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_ROWS).execute(
+            tables.EXPORT_CONVERSATIONS
+        )
+        for rows in result.partitions():
+            yield to_ndjson(rows)
+
+
+async def stream_conversations_async(connect):
+    """Async version; `connect` is an async context manager giving an AsyncConnection."""
+    async with connect() as conn:
+        result = await conn.stream(
+            tables.EXPORT_CONVERSATIONS, execution_options={"yield_per": EXPORT_CHUNK_ROWS}
+        )
+        async for rows in result.partitions():
+            yield to_ndjson(rows)
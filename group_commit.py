@@ -0,0 +1,244 @@
+"""
+Group commit for message inserts.
+
+With MESSAGE_GROUP_COMMIT=1, create_message hands its row to a single
+writer that collects concurrent messages for up to MESSAGE_GROUP_MAX_WAIT_MS
+(or MESSAGE_GROUP_MAX_BATCH rows) and writes them with one multi-row INSERT
+in one transaction; each caller then gets its own message_id back. A row
+whose conversation does not exist is left out and its caller gets None;
+a batch that hits an IntegrityError (e.g. unknown sender) is retried row
+by row so only the offending caller sees the error.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from sqlalchemy import insert, text
+from sqlalchemy.exc import IntegrityError
+
+import tables
+import write_behind
+from log_utils import log_event
+
+MESSAGE_GROUP_COMMIT = os.getenv("MESSAGE_GROUP_COMMIT", "0") == "1"
+MESSAGE_GROUP_MAX_BATCH = int(os.getenv("MESSAGE_GROUP_MAX_BATCH", "64"))
+MESSAGE_GROUP_MAX_WAIT_MS = float(os.getenv("MESSAGE_GROUP_MAX_WAIT_MS", "0"))
+
+# engine -> auto_increment step when a multi-row INSERT gets consecutive ids, else None
+_id_steps = {}
+
+
+def consecutive_id_step(conn):
+    """
+    MySQL returns only the first id of a multi-row INSERT. The others are
+    first + n * auto_increment_increment as long as InnoDB hands out the
+    block at once (innodb_autoinc_lock_mode 0 or 1).
+    """
+    if conn.engine not in _id_steps:
+        step = None
+        if conn.dialect.name == "mysql":
+            mode, increment = conn.execute(
+                text("SELECT @@innodb_autoinc_lock_mode, @@auto_increment_increment")
+            ).one()
+            if int(mode) in (0, 1):
+                step = int(increment)
+            else:
+                log_event("group_commit.row_inserts", logging.WARNING, innodb_autoinc_lock_mode=mode)
+        _id_steps[conn.engine] = step
+    return _id_steps[conn.engine]
+
+
+def write_batch(conn, rows):
+    """
+    Touch the conversations and inboxes, insert the messages; returns
+    message_ids in row order, None for rows whose conversation does not exist.
+    """
+    cids = sorted({row["conversation_id"] for row in rows})
+    if write_behind.LAST_MESSAGE_WRITE_BEHIND:
+        existing = set(conn.execute(tables.SELECT_CONVERSATION_IDS_SHARED, {"cids": cids}).scalars())
+    else:
+        latest = {}
+        for row in rows:
+            current = latest.get(row["conversation_id"])
+            if current is None or row["created_at"] >= current[0]:
+                latest[row["conversation_id"]] = (row["created_at"], tables.message_snippet(row["body"]))
+        # 按 conversation_id 顺序加锁，避免多个进程的批次互相死锁
+        bumps = [
+            {"cid": cid, "last_message_at": ts, "snippet": snippet}
+            for cid, (ts, snippet) in sorted(latest.items())
+        ]
+        conn.execute(tables.BUMP_LAST_MESSAGE_AT, bumps)
+        conn.execute(tables.BUMP_INBOX, bumps)
+        # 对话行已经被上面的 UPDATE 锁住，不会在提交前被删
+        existing = set(conn.execute(tables.SELECT_CONVERSATION_IDS, {"cids": cids}).scalars())
+
+    # 对话不存在的行不插入（不依赖外键，已有的表上 v001 没有加外键）
+    ids = [None] * len(rows)
+    index = [i for i, row in enumerate(rows) if row["conversation_id"] in existing]
+    for i, message_id in zip(index, insert_rows(conn, [rows[i] for i in index])):
+        ids[i] = message_id
+    return ids
+
+
+def insert_rows(conn, rows):
+    if not rows:
+        return []
+    if len(rows) == 1:
+        return [conn.execute(tables.INSERT_MESSAGE, rows[0]).lastrowid]
+    if conn.dialect.insert_returning:
+        result = conn.execute(tables.INSERT_MESSAGES_RETURNING, rows)
+        return [row.message_id for row in result]
+    step = consecutive_id_step(conn)
+    if step:
+        first = conn.execute(insert(tables.messages).values(rows)).lastrowid
+        return [first + i * step for i in range(len(rows))]
+    # 无法推出每行的 id 时逐行插入，但仍然只提交一次
+    return [conn.execute(tables.INSERT_MESSAGE, row).lastrowid for row in rows]
+
+
+def settle(future, message_id=None, error=None):
+    # 请求可能已经取消（客户端断开），这时结果直接丢弃
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(message_id)
+
+
+class GroupCommitter:
+    """Queues message rows from concurrent requests and commits them in batches."""
+
+    def __init__(self, max_batch: int, max_wait: float):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.rows = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._async_queue = None
+        self._task = None
+
+    def _record(self, size):
+        self.batches += 1
+        self.rows += size
+
+    # ---------------- sync engine: one writer thread ----------------
+
+    def submit(self, engine, row) -> int:
+        """Queue one row and block until its batch is committed; returns message_id (None: no such conversation)."""
+        future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, args=(engine,), name="message-group-commit", daemon=True
+                )
+                self._thread.start()
+            self._queue.append((row, future))
+            self._cond.notify()
+        return future.result()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+
+    def _run(self, engine):
+        while True:
+            self._commit(engine, self._next_batch())
+
+    def _commit(self, engine, batch):
+        try:
+            with engine.begin() as conn:
+                ids = write_batch(conn, [row for row, _ in batch])
+        except IntegrityError as e:
+            if len(batch) > 1:
+                for item in batch:
+                    self._commit(engine, [item])
+                return
+            settle(batch[0][1], error=e)
+            return
+        except Exception as e:
+            log_event("group_commit.failed", logging.ERROR, size=len(batch), error=str(e))
+            for _, future in batch:
+                settle(future, error=e)
+            return
+        self._record(len(batch))
+        for (_, future), message_id in zip(batch, ids):
+            settle(future, message_id)
+
+    # ---------------- async engine: one writer task ----------------
+
+    async def submit_async(self, engine, row) -> int:
+        if self._task is None:
+            self._async_queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run_async(engine))
+        future = asyncio.get_running_loop().create_future()
+        self._async_queue.put_nowait((row, future))
+        return await future
+
+    async def _next_batch_async(self):
+        batch = [await self._async_queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            # 已经排队的先全部取走，再按 max_wait 等后来的
+            try:
+                batch.append(self._async_queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._async_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run_async(self, engine):
+        while True:
+            await self._commit_async(engine, await self._next_batch_async())
+
+    async def _commit_async(self, engine, batch):
+        try:
+            async with engine.begin() as conn:
+                ids = await conn.run_sync(write_batch, [row for row, _ in batch])
+        except IntegrityError as e:
+            if len(batch) > 1:
+                for item in batch:
+                    await self._commit_async(engine, [item])
+                return
+            settle(batch[0][1], error=e)
+            return
+        except Exception as e:
+            log_event("group_commit.failed", logging.ERROR, size=len(batch), error=str(e))
+            for _, future in batch:
+                settle(future, error=e)
+            return
+        self._record(len(batch))
+        for (_, future), message_id in zip(batch, ids):
+            settle(future, message_id)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": MESSAGE_GROUP_COMMIT,
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch_size": self.rows / self.batches if self.batches else 0.0,
+        }
+
+
+messages = GroupCommitter(MESSAGE_GROUP_MAX_BATCH, MESSAGE_GROUP_MAX_WAIT_MS / 1000)
@@ -0,0 +1,47 @@
+import os
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+# Security / Identity Service 共用的连接池配置
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "1"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "5"))
+
+# (connect, read) 分开设置，连接失败时可以尽快返回
+TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+
+def make_session(pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    """
+    Session with a keep-alive connection pool, so repeated calls to the
+    same host reuse TCP connections instead of opening a new one each time.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+
+session = make_session()
+
+
+def make_async_client(pool_size: int = HTTP_POOL_SIZE) -> httpx.AsyncClient:
+    """
+    Non-blocking client for async dependencies; waiting on the remote
+    service does not hold a worker thread.
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=pool_size, max_keepalive_connections=pool_size
+        ),
+        timeout=httpx.Timeout(
+            HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_READ_TIMEOUT
+        ),
+    )
+
+
+async_client = make_async_client()
@@ -0,0 +1,110 @@
+import logging
+import os
+
+import requests
+
+import http_client
+from log_utils import log_event
+from auth_utils import TTLCache
+
+IDENTITY_SERVICE_URL = os.getenv("IDENTITY_SERVICE_URL", "http://127.0.0.1:8001")
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "300"))
+IDENTITY_CACHE_MAXSIZE = int(os.getenv("IDENTITY_CACHE_MAXSIZE", "4096"))
+# 单次批量请求最多包含的 user_id 数
+IDENTITY_BATCH_SIZE = int(os.getenv("IDENTITY_BATCH_SIZE", "100"))
+
+user_cache = TTLCache(IDENTITY_CACHE_MAXSIZE, IDENTITY_CACHE_TTL)
+
+
+def _get(path, **params):
+    """GET from the identity service; returns the Response, or None if the request failed."""
+    try:
+        return http_client.session.get(
+            f"{IDENTITY_SERVICE_URL}{path}", params=params or None, timeout=http_client.TIMEOUT
+        )
+    except requests.RequestException as e:
+        log_event("identity.fetch_failed", logging.WARNING, path=path, error=str(e))
+        return None
+
+
+def _json(response, path):
+    try:
+        return response.json()
+    except ValueError as e:
+        log_event("identity.bad_response", logging.WARNING, path=path, error=str(e))
+        return None
+
+
+def fetch_user(user_id):
+    """One GET /users/{id}; None if the identity service doesn't know the user or fails."""
+    path = f"/users/{user_id}"
+    response = _get(path)
+    if response is None:
+        return None
+    if response.status_code != 200:
+        # 404 是正常的“查无此人”，其余状态码说明服务有问题
+        level = logging.DEBUG if response.status_code == 404 else logging.WARNING
+        log_event("identity.non_200", level, path=path, status=response.status_code)
+        return None
+    data = _json(response, path)
+    return data if isinstance(data, dict) else None
+
+
+def fetch_users(user_ids):
+    """
+    One GET /users?ids=1,2,3 to the identity service; a single id goes to
+    GET /users/{id}. If the service has no batch endpoint (404), falls
+    back to one GET /users/{id} per id.
+    Returns {user_id: user_data} for the users it knows about.
+    """
+    user_ids = list(user_ids)
+    if len(user_ids) == 1:
+        user = fetch_user(user_ids[0])
+        return {user_ids[0]: user} if user is not None else {}
+
+    response = _get("/users", ids=",".join(str(uid) for uid in user_ids))
+    if response is None:
+        return {}
+    if response.status_code == 404:
+        log_event("identity.batch_unsupported", logging.WARNING, count=len(user_ids))
+        fetched = {uid: fetch_user(uid) for uid in user_ids}
+        return {uid: user for uid, user in fetched.items() if user is not None}
+    if response.status_code != 200:
+        log_event("identity.non_200", logging.WARNING, path="/users", status=response.status_code)
+        return {}
+    data = _json(response, "/users")
+    users = data.get("users", []) if isinstance(data, dict) else data or []
+    return {u["user_id"]: u for u in users if isinstance(u, dict) and "user_id" in u}
+
+
+def get_users(user_ids):
+    """
+    Resolve many users at once: hits come from the cache, all misses are
+    fetched together in batches of IDENTITY_BATCH_SIZE.
+    Unknown users are left out of the result.
+    """
+    found = {}
+    missing = []
+    for uid in dict.fromkeys(user_ids):
+        user = user_cache.get(uid)
+        if user is None:
+            missing.append(uid)
+        else:
+            found[uid] = user
+
+    for i in range(0, len(missing), IDENTITY_BATCH_SIZE):
+        fetched = fetch_users(missing[i:i + IDENTITY_BATCH_SIZE])
+        for uid, user in fetched.items():
+            user_cache.set(uid, user)
+        found.update(fetched)
+
+    return found
+
+
+def get_user(user_id: int):
+    return get_users([user_id]).get(user_id)
+
+
+def get_user_uni(user_id: int) -> str:
+    user = get_user(user_id)
+    return (user or {}).get("uni", f"user_{user_id}")
@@ -0,0 +1,80 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# 按事件采样，例如 LOG_SAMPLE_RATES="auth.verified=0.1,conversation.user_checked=0.01"
+LOG_SAMPLE_RATES = {
+    name.strip(): float(rate)
+    for name, rate in (
+        item.split("=", 1) for item in os.getenv("LOG_SAMPLE_RATES", "").split(",") if "=" in item
+    )
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, event and the event's fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without formatting them.
+    When the queue is full the record is dropped instead of blocking
+    the request thread.
+    """
+
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+queue_handler = DroppingQueueHandler(log_queue)
+
+stream_handler = logging.StreamHandler(sys.stdout)
+stream_handler.setFormatter(JsonFormatter())
+listener = QueueListener(log_queue, stream_handler)
+listener.start()
+atexit.register(listener.stop)
+
+logger = logging.getLogger("lionswap")
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(queue_handler)
+logger.propagate = False
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    """
+    Log a structured event. The caller only pays for the level check,
+    sampling and a queue put; formatting and the write happen on the
+    listener thread.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    rate = LOG_SAMPLE_RATES.get(event, 1.0)
+    if rate < 1.0 and random.random() >= rate:
+        return
+    logger.log(level, event, extra={"fields": fields})
@@ -1,6 +1,8 @@
-from fastapi import FastAPI, HTTPException, Header, Response
+from fastapi import APIRouter, FastAPI, HTTPException, Header, Query, Response
+from fastapi.responses import StreamingResponse
 from typing import List, Optional #
 from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 import time
 from concurrent.futures import ThreadPoolExecutor
@@ -8,7 +10,11 @@ import uuid
 from datetime import datetime
 from fastapi import HTTPException
 from fastapi import Depends
-from auth_utils import verify_token
+from auth_utils import verify_token_async
+import logging
+from log_utils import log_event
+import identity_client
+import http_client
 from typing import Dict, Any
 
 
@@ -19,7 +25,17 @@ executor = ThreadPoolExecutor(max_workers=4)
 # In-memory task status store
 TASK_STATUS = {}
 
-from database import engine
+from database import engine, read_router, DB_ASYNC
+import tables
+import database
+import write_behind
+import group_commit
+import pagination
+import etags
+import export
+import migrate
+from fastapi.concurrency import run_in_threadpool
+import async_api
 from models.conversation_models import ConversationCreate, ConversationRead
 from models.message_models import MessageCreate, MessageRead
 from fastapi.middleware.cors import CORSMiddleware
@@ -58,19 +74,55 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Conversation / Message 接口；DB_ASYNC=1 时改用 async_api.router
+router = APIRouter()
+
 def get_user_uni_from_identity_service(user_id: int) -> str:
-    """Fetch user's uni from the identity/security service"""
+    """Fetch user's uni from the identity/security service (cached)"""
+    # Falls back to a placeholder when the identity service doesn't know the user
+    return identity_client.get_user_uni(user_id)
+
+
+@app.on_event("startup")
+async def warm_db_pool():
+    """Apply migrations if DB_AUTO_MIGRATE, then open the pool's connections before the first request arrives."""
+    if database.DB_AUTO_MIGRATE:
+        await run_in_threadpool(migrate.upgrade)
+        if DB_ASYNC and database.is_memory_sqlite(database.ASYNC_DATABASE_URL):
+            # 内存 SQLite 的 async engine 是另一个数据库
+            async with database.async_engine.begin() as conn:
+                await conn.run_sync(migrate.upgrade_conn)
     try:
-        # Try to get user info from security service
-        response = requests.get(f"http://127.0.0.1:8001/users/{user_id}", timeout=5)
-        if response.status_code == 200:
-            user_data = response.json()
-            return user_data.get("uni", f"user_{user_id}")
+        if DB_ASYNC:
+            await database.warm_async_pool()
+        else:
+            await run_in_threadpool(database.warm_pool)
     except Exception as e:
-        print(f"Error fetching user {user_id} from identity service: {e}")
-    
-    # Fallback to placeholder
-    return f"user_{user_id}"
+        log_event("db.pool_warm_failed", logging.WARNING, error=str(e))
+    if write_behind.LAST_MESSAGE_WRITE_BEHIND:
+        if DB_ASYNC:
+            write_behind.last_message_at.start_async(database.async_engine)
+        else:
+            write_behind.last_message_at.start(engine)
+
+
+@app.on_event("shutdown")
+async def flush_write_behind():
+    """Apply pending last_message_at bumps before the process exits."""
+    if not write_behind.LAST_MESSAGE_WRITE_BEHIND:
+        return
+    if DB_ASYNC:
+        await write_behind.last_message_at.stop_async(database.async_engine)
+    else:
+        await run_in_threadpool(write_behind.last_message_at.stop, engine)
+
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """Close the keep-alive connections to the Security / Identity services."""
+    await http_client.async_client.aclose()
+    http_client.session.close()
+
 
 @app.get("/health/db")
 def health_check():
@@ -79,47 +131,66 @@ def health_check():
         return {"db_ok": result.scalar() == 1}
 
 
+@app.get("/health/db/pool")
+def pool_diagnostics():
+    """Live connection pool stats: checked out, overflow, checkout wait, connect rate."""
+    return {
+        **database.pool_stats(),
+        "write_behind": write_behind.last_message_at.stats(),
+        "group_commit": group_commit.messages.stats(),
+    }
+
+
 # ============================================================
 # Conversations Endpoints
 # ============================================================
 
 
-@app.get("/conversations")
-def get_conversations(user: Dict[str, Any] = Depends(verify_token)):
+@router.get("/conversations")
+def get_conversations(
+    response: Response,
+    limit: int = Query(pagination.CONVERSATIONS_PAGE_SIZE, ge=1, le=pagination.CONVERSATIONS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fresh: bool = False,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    if_none_match: Optional[str] = Header(None),
+    user: Dict[str, Any] = Depends(verify_token_async),
+):
     """
-    获取对话列表。需要 JWT 认证。
+    获取对话列表，按最近消息时间倒序分页。需要 JWT 认证。
+    下一页传上一页返回的 next_cursor；fresh=true 时先 flush 待写的 last_message_at，并从主库读取。
+    format=ndjson（仅 admin）流式导出全部对话，每行一个 JSON。
     """
     user_id = user["user_id"]
     role = user.get("role", "user")
 
-    print(user_id)
-
-    with engine.connect() as conn:
-        if role == "admin":
-            query = text("""
-                SELECT c.*, 
-                       ua.student_name as user_a_name, ua.uni as user_a_uni,
-                       ub.student_name as user_b_name, ub.uni as user_b_uni
-                FROM Conversations c
-                LEFT JOIN Users ua ON c.user_a_id = ua.user_id
-                LEFT JOIN Users ub ON c.user_b_id = ub.user_id
-            """)
-            result = conn.execute(query)
-        else:
-            query = text("""
-                SELECT c.*, 
-                       ua.student_name as user_a_name, ua.uni as user_a_uni,
-                       ub.student_name as user_b_name, ub.uni as user_b_uni
-                FROM Conversations c
-                LEFT JOIN Users ua ON c.user_a_id = ua.user_id
-                LEFT JOIN Users ub ON c.user_b_id = ub.user_id
-                WHERE c.user_a_id=:uid OR c.user_b_id=:uid
-            """)
-            result = conn.execute(query, {"uid": user_id})
-        # 将结果转换为字典列表
-        return {"conversations": [dict(row._mapping) for row in result]}
-
-@app.post("/conversations", response_model=ConversationRead)
+    log_event("conversations.list", logging.DEBUG, user_id=user_id, role=role)
+
+    if format == "ndjson":
+        # admin 导出全部对话，逐块流式输出，内存占用与表大小无关
+        if role != "admin":
+            raise HTTPException(status_code=403, detail="Export is admin only")
+        return StreamingResponse(export.stream_conversations(read_router.connect), media_type=export.NDJSON)
+
+    if fresh:
+        write_behind.last_message_at.flush(engine)
+    scope = "all" if role == "admin" else "user"
+    query, params = pagination.conversation_page(scope, user_id, limit, cursor)
+    with (engine.connect() if fresh else read_router.connect(user_id=user_id)) as conn:
+        if scope == "user":
+            # 轮询时先比较收件箱版本，没变就 304，不跑分页查询
+            version = conn.execute(tables.SELECT_INBOX_VERSION, {"uid": user_id}).one()
+            headers = {
+                "ETag": pagination.inbox_etag(user_id, limit, cursor, version),
+                "Cache-Control": etags.PRIVATE_REVALIDATE,
+            }
+            if etags.matches(if_none_match, headers["ETag"]):
+                return etags.not_modified(headers)
+            response.headers.update(headers)
+        rows = [dict(row._mapping) for row in conn.execute(query, params)]
+    return pagination.page_response(rows, limit)
+
+@router.post("/conversations", response_model=ConversationRead)
 def create_conversation(conv: ConversationCreate):
     with engine.begin() as conn:
         # enforce user_a_id < user_b_id convention
@@ -135,210 +206,307 @@ def create_conversation(conv: ConversationCreate):
 
         # Auto-create users if they don't exist
         for user_id in [user_a_id, user_b_id]:
-            print(f"Checking if user {user_id} exists...")
-            check = conn.execute(text("SELECT user_id FROM Users WHERE user_id = :user_id"), {"user_id": user_id}).fetchone()
-            print(f"User {user_id} exists: {check is not None}")
+            check = conn.execute(tables.SELECT_USER_ID, {"user_id": user_id}).fetchone()
+            log_event("conversation.user_checked", logging.DEBUG, user_id=user_id, exists=check is not None)
             if not check:
                 try:
-                    print(f"Creating user {user_id} with uni {unis[user_id]}...")
-                    conn.execute(text("INSERT INTO Users (user_id, uni, student_name, email) VALUES (:user_id, :uni, :name, :email)"), 
+                    conn.execute(tables.INSERT_USER, 
                                 {"user_id": user_id, "uni": unis[user_id], "name": unis[user_id], "email": f"{unis[user_id]}@columbia.edu"})
-                    print(f"User {user_id} created successfully")
+                    log_event("conversation.user_created", user_id=user_id, uni=unis[user_id])
                 except Exception as e:
-                    print(f"Error creating user {user_id}: {e}")
+                    log_event("conversation.user_create_failed", logging.ERROR, user_id=user_id, error=str(e))
                     raise
 
         # Check if conversation already exists
-        check_query = text("SELECT * FROM Conversations WHERE user_a_id = :user_a AND user_b_id = :user_b")
+        check_query = tables.SELECT_CONVERSATION_BY_PAIR
         existing = conn.execute(check_query, {"user_a": user_a_id, "user_b": user_b_id}).mappings().first()
         
         if existing:
-            print(f"Conversation already exists: {existing['conversation_id']}")
+            log_event("conversation.exists", logging.DEBUG, conversation_id=existing["conversation_id"])
             return dict(existing)
         
-        print(f"Creating conversation between {user_a_id} and {user_b_id}...")
-        insert_stmt = text("""
-            INSERT INTO Conversations (user_a_id, user_b_id)
-            VALUES (:user_a_id, :user_b_id)
-        """)
-        result = conn.execute(insert_stmt, {"user_a_id": user_a_id, "user_b_id": user_b_id})
+        log_event("conversation.create", user_a_id=user_a_id, user_b_id=user_b_id)
+        insert_stmt = tables.INSERT_CONVERSATION
+        result = conn.execute(
+            insert_stmt, {"user_a_id": user_a_id, "user_b_id": user_b_id, "created_at": tables.db_now()}
+        )
 
         conversation_id = result.lastrowid
+        # 双方的收件箱各一行
+        conn.execute(tables.INSERT_INBOX, {"cid": conversation_id})
 
         # fetch newly inserted row
-        query = text("SELECT * FROM Conversations WHERE conversation_id = :cid")
+        query = tables.SELECT_CONVERSATION
         row = conn.execute(query, {"cid": conversation_id}).mappings().first()
 
     if not row:
         raise HTTPException(status_code=500, detail="Failed to create conversation")
+    read_router.note_write(user_id=user_a_id, conversation_id=conversation_id)
+    read_router.note_write(user_id=user_b_id)
     return dict(row)
 
 
-@app.get("/conversations/{conversation_id}", response_model=ConversationRead)
-def get_conversation(conversation_id: int):
-    with engine.connect() as conn:
-        query = text("SELECT * FROM Conversations WHERE conversation_id = :cid")
+@router.get("/conversations/{conversation_id}", response_model=ConversationRead)
+def get_conversation(conversation_id: int, fresh: bool = False):
+    if fresh:
+        write_behind.last_message_at.flush(engine)
+    with (engine.connect() if fresh else read_router.connect(conversation_id=conversation_id)) as conn:
+        query = tables.SELECT_CONVERSATION
         row = conn.execute(query, {"cid": conversation_id}).mappings().first()
     if not row:
         raise HTTPException(status_code=404, detail="Conversation not found")
     return dict(row)
 
 
-@app.put("/conversations/{conversation_id}", response_model=ConversationRead)
+@router.put("/conversations/{conversation_id}", response_model=ConversationRead)
 def update_conversation(conversation_id: int, conv: ConversationCreate):
     with engine.connect() as conn:
-        stmt = text("""
-            UPDATE Conversations
-            SET user_a_id = :user_a_id,
-                user_b_id = :user_b_id
-            WHERE conversation_id = :cid
-        """)
+        previous_users = conn.execute(tables.SELECT_CONVERSATION_USERS, {"cid": conversation_id}).first()
+        stmt = tables.UPDATE_CONVERSATION
         conn.execute(stmt, {
             "user_a_id": conv.user_a_id,
             "user_b_id": conv.user_b_id,
             "cid": conversation_id,
         })
+        # 对话双方变了，重建收件箱行；留下来的用户保留已读水位，version 继续往上加
+        state = conn.execute(tables.SELECT_INBOX_STATE, {"cid": conversation_id}).all()
+        conn.execute(tables.DELETE_INBOX, {"cid": conversation_id})
+        conn.execute(tables.INSERT_INBOX, {"cid": conversation_id})
+        if state:
+            conn.execute(tables.RESTORE_INBOX_STATE, [
+                {"cid": conversation_id, "uid": uid, "mid": mid, "prev_version": version}
+                for uid, mid, version in state
+            ])
         conn.commit()
 
         row = conn.execute(
-            text("SELECT * FROM Conversations WHERE conversation_id = :cid"),
+            tables.SELECT_CONVERSATION,
             {"cid": conversation_id},
         ).mappings().first()
 
+    # 原来的双方和新的双方，GET /conversations 都按 user_id 路由
+    for user_id in set(previous_users or ()) | {conv.user_a_id, conv.user_b_id}:
+        read_router.note_write(user_id=user_id)
+    read_router.note_write(conversation_id=conversation_id)
     if not row:
         raise HTTPException(status_code=404, detail="Conversation not found after update")
     return dict(row)
 
 
-@app.delete("/conversations/{conversation_id}")
+@router.delete("/conversations/{conversation_id}")
 def delete_conversation(conversation_id: int):
     with engine.connect() as conn:
+        users = conn.execute(tables.SELECT_CONVERSATION_USERS, {"cid": conversation_id}).first()
         result = conn.execute(
-            text("DELETE FROM Conversations WHERE conversation_id = :cid"),
+            tables.DELETE_CONVERSATION,
             {"cid": conversation_id},
         )
         conn.commit()
+    for user_id in users or ():
+        read_router.note_write(user_id=user_id)
+    read_router.note_write(conversation_id=conversation_id)
     if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="Conversation not found")
     return {"deleted": True, "conversation_id": conversation_id}
 
 
+@router.post("/conversations/{conversation_id}/read")
+def mark_conversation_read(
+    conversation_id: int,
+    message_id: Optional[int] = None,
+    user: Dict[str, Any] = Depends(verify_token_async),
+):
+    """
+    把当前用户在该对话的已读水位前移到 message_id（默认最新一条），
+    返回收件箱里这一行，包括新的 unread_count。
+    """
+    user_id = user["user_id"]
+    with engine.begin() as conn:
+        latest = conn.execute(tables.SELECT_LATEST_MESSAGE_ID, {"cid": conversation_id}).scalar() or 0
+        read_up_to = latest if message_id is None else min(message_id, latest)
+        conn.execute(tables.MARK_READ, {"uid": user_id, "cid": conversation_id, "mid": read_up_to})
+        row = conn.execute(
+            tables.SELECT_INBOX_ROW, {"uid": user_id, "cid": conversation_id}
+        ).mappings().first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    read_router.note_write(user_id=user_id, conversation_id=conversation_id)
+    return dict(row)
+
+
 # ============================================================
 # Messages Endpoints
 # ============================================================
 
-@app.get("/conversations/{conversation_id}/messages", response_model=List[MessageRead])
-def list_messages(conversation_id: int):
-    with engine.connect() as conn:
+@router.get("/conversations/{conversation_id}/messages", response_model=List[MessageRead])
+def list_messages(
+    conversation_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+):
+    # 本 worker 还有没写入的 version 更新时先 flush，否则会对刚发的消息回 304
+    if write_behind.last_message_at.has_pending(conversation_id):
+        write_behind.last_message_at.flush(engine)
+    with read_router.connect(conversation_id=conversation_id) as conn:
+        version = conn.execute(tables.SELECT_CONVERSATION_VERSION, {"cid": conversation_id}).first()
+        if version is not None:
+            headers = {
+                "ETag": etags.make_etag("messages", conversation_id, version.created_at, version.version),
+                "Last-Modified": etags.http_date(version.updated_at),
+                "Cache-Control": etags.PRIVATE_REVALIDATE,
+            }
+            if etags.matches(if_none_match, headers["ETag"]):
+                return etags.not_modified(headers)
+            response.headers.update(headers)
         result = conn.execute(
-            text("""
-                SELECT * FROM Messages
-                WHERE conversation_id = :cid
-                ORDER BY created_at ASC
-            """),
+            tables.LIST_MESSAGES,
             {"cid": conversation_id},
         )
         rows = [dict(row._mapping) for row in result]
     return rows
 
 
-@app.post("/messages", response_model=MessageRead)
+def insert_message(values):
+    """
+    Touch the conversation and insert one message in its own transaction;
+    returns message_id, or None when the conversation does not exist.
+    """
+    with engine.begin() as conn:
+        if write_behind.LAST_MESSAGE_WRITE_BEHIND:
+            # last_message_at 交给后台 flusher 批量更新，这里不锁对话行；
+            # INSERT ... SELECT 在对话不存在时插入 0 行
+            result = conn.execute(tables.INSERT_MESSAGE, values)
+            if result.rowcount == 0:
+                return None
+        else:
+            touched = conn.execute(
+                tables.BUMP_LAST_MESSAGE_AT,
+                {"cid": values["conversation_id"], "last_message_at": values["created_at"]},
+            )
+            if touched.rowcount == 0:
+                return None
+            result = conn.execute(tables.INSERT_MESSAGE, values)
+            conn.execute(tables.BUMP_INBOX, {
+                "cid": values["conversation_id"],
+                "last_message_at": values["created_at"],
+                "snippet": tables.message_snippet(values["body"]),
+            })
+    return result.lastrowid
+
+
+@router.post("/messages", response_model=MessageRead)
 def create_message(msg: MessageCreate):
-    with engine.connect() as conn:
-        insert_stmt = text("""
-            INSERT INTO Messages (conversation_id, sender_id, message_type, body, attachment_url)
-            VALUES (:conversation_id, :sender_id, :message_type, :body, :attachment_url)
-        """)
-        result = conn.execute(insert_stmt, {
-            "conversation_id": msg.conversation_id,
-            "sender_id": msg.sender_id,
-            "message_type": msg.message_type,
-            "body": msg.body,
-            "attachment_url": msg.attachment_url,
-        })
-        conn.commit()
-
-        message_id = result.lastrowid
-
-        
-        conn.execute(
-            text("UPDATE Conversations SET last_message_at = NOW() WHERE conversation_id = :cid"),
-            {"cid": msg.conversation_id},
-        )
-        conn.commit()
-
-        row = conn.execute(
-            text("SELECT * FROM Messages WHERE message_id = :mid"),
-            {"mid": message_id},
-        ).mappings().first()
+    # 一个事务完成：更新对话时间 + 插入消息，响应直接由写入的值构造，不再回读
+    values = {
+        "conversation_id": msg.conversation_id,
+        "sender_id": msg.sender_id,
+        "message_type": msg.message_type,
+        "body": msg.body,
+        "attachment_url": msg.attachment_url,
+        "created_at": tables.db_now(),
+    }
+    try:
+        if group_commit.MESSAGE_GROUP_COMMIT:
+            # 并发的消息合并成一个事务、一条多行 INSERT 写入
+            message_id = group_commit.messages.submit(engine, values)
+        else:
+            message_id = insert_message(values)
+    except IntegrityError as e:
+        # 对话是否存在已经单独查过，这里是其他约束（例如 sender_id 不是用户），三种写入模式一样处理
+        log_event("message.rejected", logging.WARNING, conversation_id=msg.conversation_id,
+                  sender_id=msg.sender_id, error=str(e.orig))
+        raise HTTPException(status_code=422, detail="Message violates a database constraint")
+    if message_id is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
 
-    if not row:
-        raise HTTPException(status_code=500, detail="Failed to create message")
-    return dict(row)
+    if write_behind.LAST_MESSAGE_WRITE_BEHIND:
+        write_behind.last_message_at.add(msg.conversation_id, values["created_at"])
+    read_router.note_write(user_id=msg.sender_id, conversation_id=msg.conversation_id, message_id=message_id)
+    return {"message_id": message_id, **values}
 
 
 # 4. 修复：正确添加 response 和 if_none_match 参数
-@app.get("/messages/{message_id}", response_model=MessageRead)
+@router.get("/messages/{message_id}", response_model=MessageRead)
 def get_message(
-    message_id: int, 
-    response: Response, 
+    message_id: int,
+    response: Response,
     if_none_match: Optional[str] = Header(None)
 ):
-    with engine.connect() as conn:
-        row = conn.execute(
-            text("SELECT * FROM Messages WHERE message_id = :mid"),
-            {"mid": message_id},
-        ).mappings().first()
+    # ETag 里带着 conversation_id / edit_version：先只查对话这一行，没变就 304，不读 Messages
+    conversation_id = etags.message_etag_conversation(if_none_match)
+    if conversation_id is not None:
+        with read_router.connect(conversation_id=conversation_id) as conn:
+            version = conn.execute(tables.SELECT_CONVERSATION_VERSION, {"cid": conversation_id}).first()
+        if version is not None:
+            etag_value = etags.message_etag(message_id, conversation_id, version.created_at, version.edit_version)
+            if etags.matches(if_none_match, etag_value):
+                return etags.not_modified({"ETag": etag_value, "Cache-Control": etags.message_cache_control()})
+
+    with read_router.connect(message_id=message_id) as conn:
+        row = conn.execute(tables.SELECT_MESSAGE_VERSIONED, {"mid": message_id}).mappings().first()
     if not row:
         raise HTTPException(status_code=404, detail="Message not found")
-    
-    message_dict = dict(row)
-    etag_value = f"W/{hash(frozenset(message_dict.items()))}"
-
-    if if_none_match == etag_value:
-        response.status_code = 304
-        return response
 
-    response.headers["ETag"] = etag_value
+    message_dict = dict(row)
+    etag_value = etags.message_etag(
+        message_id,
+        message_dict["conversation_id"],
+        message_dict.pop("conversation_created_at"),
+        message_dict.pop("conversation_edit_version"),
+    )
+    headers = {"ETag": etag_value, "Cache-Control": etags.message_cache_control()}
+    if etags.matches(if_none_match, etag_value):
+        return etags.not_modified(headers)
+
+    response.headers.update(headers)
     return message_dict
 
 
-@app.put("/messages/{message_id}", response_model=MessageRead)
+@router.put("/messages/{message_id}", response_model=MessageRead)
 def update_message(message_id: int, msg: MessageCreate):
     with engine.connect() as conn:
-        stmt = text("""
-            UPDATE Messages
-            SET body = :body,
-                message_type = :message_type,
-                attachment_url = :attachment_url
-            WHERE message_id = :mid
-        """)
+        stmt = tables.UPDATE_MESSAGE
         result = conn.execute(stmt, {
             "body": msg.body,
             "message_type": msg.message_type,
             "attachment_url": msg.attachment_url,
             "mid": message_id,
         })
-        conn.commit()
-
         row = conn.execute(
-            text("SELECT * FROM Messages WHERE message_id = :mid"),
+            tables.SELECT_MESSAGE,
             {"mid": message_id},
         ).mappings().first()
+        if row:
+            # 收件箱里的 snippet 可能就是这条消息；消息列表的 ETag 也要变
+            conn.execute(tables.REFRESH_INBOX_SNIPPET, {"cid": row["conversation_id"]})
+            conn.execute(
+                tables.BUMP_CONVERSATION_VERSION, {"cid": row["conversation_id"], "updated_at": tables.db_now()}
+            )
+        conn.commit()
 
     if not row:
         raise HTTPException(status_code=404, detail="Message not found after update")
+    # UPDATE 不改 conversation_id，请求体里的值可能指向别的对话
+    read_router.note_write(user_id=msg.sender_id, conversation_id=row["conversation_id"], message_id=message_id)
     return dict(row)
 
 
-@app.delete("/messages/{message_id}")
+@router.delete("/messages/{message_id}")
 def delete_message(message_id: int):
     with engine.connect() as conn:
+        row = conn.execute(tables.SELECT_MESSAGE, {"mid": message_id}).mappings().first()
         result = conn.execute(
-            text("DELETE FROM Messages WHERE message_id = :mid"),
+            tables.DELETE_MESSAGE,
             {"mid": message_id},
         )
+        if row:
+            conn.execute(tables.REFRESH_INBOX_SNIPPET, {"cid": row["conversation_id"]})
+            conn.execute(
+                tables.BUMP_CONVERSATION_VERSION, {"cid": row["conversation_id"], "updated_at": tables.db_now()}
+            )
         conn.commit()
+    if row:
+        read_router.note_write(conversation_id=row["conversation_id"], message_id=message_id)
     if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="Message not found")
     return {"deleted": True, "message_id": message_id}
@@ -368,4 +536,7 @@ def build_summary(conversation_id: int):
 def get_task_status(task_id: str):
     if task_id not in TASK_STATUS:
         raise HTTPException(status_code=404, detail="Unknown task ID.")
-    return TASK_STATUS[task_id]
\ No newline at end of file
+    return TASK_STATUS[task_id]
+
+
+app.include_router(async_api.router if DB_ASYNC else router)
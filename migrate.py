@@ -0,0 +1,208 @@
+"""
+Schema migrations and index checks.
+
+    python migrate.py            # apply pending migrations
+    python migrate.py status     # list applied / pending versions
+    python migrate.py check      # EXPLAIN the hot queries, exit 1 if one stops using an index
+"""
+import glob
+import importlib
+import os
+import sys
+from datetime import datetime
+
+from sqlalchemy import text
+
+import tables
+from database import engine
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# (name, statement the service runs, params, index names that must serve it)
+HOT_QUERIES = [
+    (
+        "list_messages",
+        tables.LIST_MESSAGES,
+        {"cid": 1},
+        ["ix_messages_conversation_created"],
+    ),
+    (
+        "inbox_page",
+        tables.CONVERSATION_PAGES[("user", "first")],
+        {"uid": 1, "limit": 51},
+        ["ix_user_inbox_activity", "ix_messages_conversation_unread"],
+    ),
+    (
+        "inbox_page_after",
+        tables.CONVERSATION_PAGES[("user", "timestamp")],
+        {"uid": 1, "limit": 51, "after_ts": datetime(2024, 1, 1), "after_cid": 1},
+        ["ix_user_inbox_activity", "ix_messages_conversation_unread"],
+    ),
+    (
+        "inbox_version",
+        tables.SELECT_INBOX_VERSION,
+        {"uid": 1},
+        [],
+    ),
+    (
+        "bump_inbox",
+        tables.BUMP_INBOX,
+        {"cid": 1, "last_message_at": datetime(2024, 1, 1), "snippet": ""},
+        ["ix_user_inbox_conversation"],
+    ),
+    (
+        "admin_page",
+        tables.CONVERSATION_PAGES[("all", "first")],
+        {"limit": 51},
+        ["ix_conversations_activity"],
+    ),
+    (
+        "find_conversation",
+        tables.SELECT_CONVERSATION_BY_PAIR,
+        {"user_a": 1, "user_b": 2},
+        [],
+    ),
+    (
+        "get_message",
+        tables.SELECT_MESSAGE_VERSIONED,
+        {"mid": 1},
+        [],
+    ),
+    (
+        "get_conversation",
+        tables.SELECT_CONVERSATION,
+        {"cid": 1},
+        [],
+    ),
+    (
+        "conversation_version",
+        tables.SELECT_CONVERSATION_VERSION,
+        {"cid": 1},
+        [],
+    ),
+]
+
+
+def available_migrations():
+    """[(version, module)] sorted by version, from migrations/vNNN_*.py."""
+    found = []
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "v[0-9]*.py"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        found.append((name, importlib.import_module(f"migrations.{name}")))
+    return found
+
+
+def applied_versions(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(255) PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def upgrade_conn(conn):
+    """Apply pending migrations on one connection; returns the versions applied."""
+    done = applied_versions(conn)
+    applied = []
+    for version, module in available_migrations():
+        if version in done:
+            continue
+        module.upgrade(conn)
+        conn.execute(
+            text("INSERT INTO schema_migrations (version) VALUES (:v)"), {"v": version}
+        )
+        applied.append(version)
+    return applied
+
+
+def upgrade(target=engine):
+    with target.begin() as conn:
+        for version in upgrade_conn(conn):
+            print(f"applied {version}")
+
+
+def status():
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    for version, _ in available_migrations():
+        print(f"{'applied' if version in done else 'pending'}  {version}")
+
+
+def explain(conn, statement, params):
+    """
+    Returns (indexes used or considered, full_scan) for one statement.
+    MySQL: EXPLAIN key / possible_keys / type; SQLite: EXPLAIN QUERY PLAN.
+    The statement is compiled for the connection's dialect exactly as the
+    service runs it; scans of its own derived tables (a LIMITed page) don't
+    count.
+    """
+    compiled = statement.compile(dialect=conn.dialect)
+    bound = compiled.construct_params(params)
+    if compiled.positiontup:
+        bound = tuple(bound[name] for name in compiled.positiontup)
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    rows = conn.exec_driver_sql(prefix + str(compiled), bound).all()
+    if conn.dialect.name == "sqlite":
+        plan = [row[-1] for row in rows]
+        derived = {
+            line.split()[-1] for line in plan if line.startswith(("CO-ROUTINE", "MATERIALIZE"))
+        }
+        used = {
+            word for line in plan for word in line.replace("(", " ").split()
+            if word.startswith(("ix_", "uq_", "sqlite_autoindex_"))
+        }
+        if any("INTEGER PRIMARY KEY" in line for line in plan):
+            used.add("PRIMARY")
+        full_scan = any(
+            line.startswith("SCAN") and "INDEX" not in line and line.split()[1] not in derived
+            for line in plan
+        )
+        return used, full_scan
+
+    rows = [dict(row._mapping) for row in rows]
+    used = set()
+    for row in rows:
+        for col in ("key", "possible_keys"):
+            used.update(k for k in (row.get(col) or "").split(",") if k)
+    full_scan = any(
+        row.get("type") == "ALL" and not row.get("possible_keys") and not str(row.get("table")).startswith("<")
+        for row in rows
+    )
+    return used, full_scan
+
+
+def check_queries(conn):
+    """[(name, ok, indexes used, missing indexes, full_scan)] for every hot query."""
+    results = []
+    for name, statement, params, expected in HOT_QUERIES:
+        used, full_scan = explain(conn, statement, params)
+        missing = [ix for ix in expected if ix not in used]
+        results.append((name, not full_scan and not missing, used, missing, full_scan))
+    return results
+
+
+def check(target=engine):
+    with target.connect() as conn:
+        results = check_queries(conn)
+    for name, ok, used, missing, full_scan in results:
+        detail = f"indexes={sorted(used)}" + (f" missing={missing}" if missing else "")
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<20} {detail}{' full scan' if full_scan else ''}")
+    return sum(not ok for _, ok, *_ in results)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "upgrade":
+        upgrade()
+    elif command == "status":
+        status()
+    elif command == "check":
+        sys.exit(1 if check() else 0)
+    else:
+        sys.exit(f"unknown command: {command}")
+
+
+if __name__ == "__main__":
+    main()
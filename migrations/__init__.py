@@ -0,0 +1,32 @@
+"""
+Versioned schema migrations. Each vNNN_*.py module defines upgrade(conn);
+migrate.py applies the ones not yet recorded in schema_migrations.
+"""
+from sqlalchemy import inspect, text
+
+
+def has_index_on(conn, table: str, columns) -> bool:
+    """True if the primary key or some index/unique key starts with `columns`."""
+    inspector = inspect(conn)
+    columns = list(columns)
+    candidates = [inspector.get_pk_constraint(table).get("constrained_columns") or []]
+    candidates += [ix["column_names"] for ix in inspector.get_indexes(table)]
+    candidates += [uq["column_names"] for uq in inspector.get_unique_constraints(table)]
+    return any(list(c[:len(columns)]) == columns for c in candidates)
+
+
+def ensure_index(conn, name: str, table: str, columns):
+    """CREATE INDEX unless an existing index already covers the same leading columns."""
+    if has_index_on(conn, table, columns):
+        return
+    conn.execute(text(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})"))
+
+
+def drop_index(conn, name: str, table: str):
+    """DROP INDEX if it exists (MySQL needs the table name, SQLite does not accept it)."""
+    if name not in {ix["name"] for ix in inspect(conn).get_indexes(table)}:
+        return
+    if conn.dialect.name == "mysql":
+        conn.execute(text(f"DROP INDEX {name} ON {table}"))
+    else:
+        conn.execute(text(f"DROP INDEX {name}"))
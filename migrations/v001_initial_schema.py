@@ -0,0 +1,57 @@
+"""Users, Conversations and Messages tables (no-op where they already exist)."""
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    UniqueConstraint,
+    func,
+)
+
+metadata = MetaData()
+
+Table(
+    "Users",
+    metadata,
+    Column("user_id", Integer, primary_key=True, autoincrement=False),
+    Column("uni", String(32), nullable=False),
+    Column("student_name", String(255)),
+    Column("email", String(255)),
+)
+
+Table(
+    "Conversations",
+    metadata,
+    Column("conversation_id", Integer, primary_key=True, autoincrement=True),
+    Column("user_a_id", Integer, ForeignKey("Users.user_id"), nullable=False),
+    Column("user_b_id", Integer, ForeignKey("Users.user_id"), nullable=False),
+    Column("created_at", DateTime, nullable=False, server_default=func.now()),
+    Column("last_message_at", DateTime, nullable=True),
+    # user_a_id < user_b_id, so one row per pair
+    UniqueConstraint("user_a_id", "user_b_id", name="uq_conversations_pair"),
+)
+
+Table(
+    "Messages",
+    metadata,
+    Column("message_id", Integer, primary_key=True, autoincrement=True),
+    Column(
+        "conversation_id",
+        Integer,
+        ForeignKey("Conversations.conversation_id", ondelete="CASCADE"),
+        nullable=False,
+    ),
+    Column("sender_id", Integer, ForeignKey("Users.user_id"), nullable=False),
+    Column("message_type", String(16), nullable=False, server_default="TEXT"),
+    Column("body", Text, nullable=False),
+    Column("attachment_url", String(1024)),
+    Column("created_at", DateTime, nullable=False, server_default=func.now()),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
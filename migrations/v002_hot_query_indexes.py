@@ -0,0 +1,13 @@
+"""
+Indexes for the hot queries:
+  list_messages      WHERE conversation_id = ? ORDER BY created_at
+  get_conversations  WHERE user_a_id = ? OR user_b_id = ?  (index merge)
+  create_conversation WHERE user_a_id = ? AND user_b_id = ?
+"""
+from migrations import ensure_index
+
+
+def upgrade(conn):
+    ensure_index(conn, "ix_messages_conversation_created", "Messages", ["conversation_id", "created_at"])
+    ensure_index(conn, "ix_conversations_user_a_user_b", "Conversations", ["user_a_id", "user_b_id"])
+    ensure_index(conn, "ix_conversations_user_b", "Conversations", ["user_b_id"])
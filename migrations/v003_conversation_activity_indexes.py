@@ -0,0 +1,20 @@
+"""
+Indexes for the keyset-paginated inbox, newest activity first:
+  user inbox   WHERE user_a_id = ? / user_b_id = ?  ORDER BY last_message_at DESC, conversation_id DESC
+  admin list   ORDER BY last_message_at DESC, conversation_id DESC
+"""
+from migrations import ensure_index
+
+
+def upgrade(conn):
+    ensure_index(
+        conn, "ix_conversations_user_a_activity", "Conversations",
+        ["user_a_id", "last_message_at", "conversation_id"],
+    )
+    ensure_index(
+        conn, "ix_conversations_user_b_activity", "Conversations",
+        ["user_b_id", "last_message_at", "conversation_id"],
+    )
+    ensure_index(
+        conn, "ix_conversations_activity", "Conversations", ["last_message_at", "conversation_id"]
+    )
@@ -0,0 +1,81 @@
+"""
+UserInbox: one row per (user_id, conversation_id) with the peer's id /
+name / uni, last_message_at and a snippet of the latest message, so a
+user's inbox page is a single index range read. Kept in sync by the
+conversation and message handlers; this migration backfills it.
+
+The per-user Conversations activity indexes from v003 are no longer read
+and only slow down last_message_at updates, so they are dropped.
+"""
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    text,
+)
+
+from migrations import drop_index
+
+SNIPPET_LENGTH = 100
+
+metadata = MetaData()
+
+Table(
+    "Conversations",
+    metadata,
+    Column("conversation_id", Integer, primary_key=True),
+)
+
+Table(
+    "UserInbox",
+    metadata,
+    Column("user_id", Integer, primary_key=True, autoincrement=False),
+    Column(
+        "conversation_id",
+        Integer,
+        ForeignKey("Conversations.conversation_id", ondelete="CASCADE"),
+        primary_key=True,
+        autoincrement=False,
+    ),
+    Column("peer_id", Integer, nullable=False),
+    Column("peer_name", String(255)),
+    Column("peer_uni", String(32)),
+    Column("created_at", DateTime, nullable=False),
+    Column("last_message_at", DateTime),
+    Column("snippet", String(255)),
+    Index("ix_user_inbox_activity", "user_id", "last_message_at", "conversation_id"),
+    Index("ix_user_inbox_conversation", "conversation_id"),
+)
+
+# 两个方向各一行；自己和自己的对话只保留一行
+BACKFILL_SIDE = """
+    INSERT INTO UserInbox
+        (user_id, conversation_id, peer_id, peer_name, peer_uni, created_at, last_message_at, snippet)
+    SELECT c.{me}, c.conversation_id, c.{peer}, u.student_name, u.uni, c.created_at, c.last_message_at,
+           (SELECT SUBSTR(m.body, 1, {length}) FROM Messages m
+            WHERE m.conversation_id = c.conversation_id
+            ORDER BY m.created_at DESC, m.message_id DESC LIMIT 1)
+    FROM Conversations c
+    LEFT JOIN Users u ON u.user_id = c.{peer}
+    WHERE NOT EXISTS (
+        SELECT 1 FROM UserInbox i WHERE i.user_id = c.{me} AND i.conversation_id = c.conversation_id
+    )
+"""
+
+
+def backfill(conn):
+    """Add the inbox rows missing for existing conversations."""
+    for me, peer in (("user_a_id", "user_b_id"), ("user_b_id", "user_a_id")):
+        conn.execute(text(BACKFILL_SIDE.format(me=me, peer=peer, length=SNIPPET_LENGTH)))
+
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
+    backfill(conn)
+    drop_index(conn, "ix_conversations_user_a_activity", "Conversations")
+    drop_index(conn, "ix_conversations_user_b_activity", "Conversations")
@@ -0,0 +1,25 @@
+"""
+Per-user read watermarks: UserInbox.last_read_message_id, and a
+(conversation_id, message_id, sender_id) index so the unread count for a
+conversation is a covering range read. Existing conversations start out
+fully read.
+"""
+from sqlalchemy import inspect, text
+
+from migrations import ensure_index
+
+
+def upgrade(conn):
+    columns = {c["name"] for c in inspect(conn).get_columns("UserInbox")}
+    if "last_read_message_id" not in columns:
+        conn.execute(text(
+            "ALTER TABLE UserInbox ADD COLUMN last_read_message_id INTEGER NOT NULL DEFAULT 0"
+        ))
+    conn.execute(text("""
+        UPDATE UserInbox SET last_read_message_id = COALESCE(
+            (SELECT MAX(m.message_id) FROM Messages m WHERE m.conversation_id = UserInbox.conversation_id), 0
+        )
+    """))
+    ensure_index(
+        conn, "ix_messages_conversation_unread", "Messages", ["conversation_id", "message_id", "sender_id"]
+    )
@@ -0,0 +1,14 @@
+"""
+UserInbox.version: bumped by every update of an inbox row (new message,
+snippet refresh, read watermark), so COUNT / MAX(last_message_at) /
+SUM(version) over a user's rows, a range read on the primary key, changes
+whenever their conversation list does. GET /conversations sends it as the
+ETag.
+"""
+from sqlalchemy import inspect, text
+
+
+def upgrade(conn):
+    columns = {c["name"] for c in inspect(conn).get_columns("UserInbox")}
+    if "version" not in columns:
+        conn.execute(text("ALTER TABLE UserInbox ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
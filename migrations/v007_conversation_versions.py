@@ -0,0 +1,15 @@
+"""
+Conversations.version / updated_at: changed by every write to the
+conversation's messages (insert, edit, delete), so the message history
+can be validated (ETag / Last-Modified) from the conversation row alone.
+"""
+from sqlalchemy import inspect, text
+
+
+def upgrade(conn):
+    columns = {c["name"] for c in inspect(conn).get_columns("Conversations")}
+    if "version" not in columns:
+        conn.execute(text("ALTER TABLE Conversations ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+    if "updated_at" not in columns:
+        conn.execute(text("ALTER TABLE Conversations ADD COLUMN updated_at DATETIME NULL"))
+        conn.execute(text("UPDATE Conversations SET updated_at = last_message_at"))
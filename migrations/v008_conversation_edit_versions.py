@@ -0,0 +1,12 @@
+"""
+Conversations.edit_version: bumped only when a message in the conversation
+is edited or deleted, not when one is inserted, so GET /messages/{id}
+validators survive new messages in an active chat.
+"""
+from sqlalchemy import inspect, text
+
+
+def upgrade(conn):
+    columns = {c["name"] for c in inspect(conn).get_columns("Conversations")}
+    if "edit_version" not in columns:
+        conn.execute(text("ALTER TABLE Conversations ADD COLUMN edit_version INTEGER NOT NULL DEFAULT 0"))
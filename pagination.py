@@ -0,0 +1,70 @@
+"""
+Keyset pagination for GET /conversations.
+
+Pages are ordered by (last_message_at DESC, conversation_id DESC). The
+cursor is the position of the last row of the previous page, base64url
+JSON, and is opaque to clients.
+"""
+import base64
+import binascii
+import json
+import os
+from datetime import datetime
+
+from fastapi import HTTPException
+
+import etags
+import tables
+
+CONVERSATIONS_PAGE_SIZE = int(os.getenv("CONVERSATIONS_PAGE_SIZE", "50"))
+CONVERSATIONS_MAX_PAGE_SIZE = int(os.getenv("CONVERSATIONS_MAX_PAGE_SIZE", "200"))
+
+
+def encode_cursor(row) -> str:
+    last_message_at = row["last_message_at"]
+    if isinstance(last_message_at, datetime):
+        last_message_at = last_message_at.isoformat()
+    raw = json.dumps([last_message_at, row["conversation_id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        last_message_at, conversation_id = json.loads(raw)
+        if last_message_at is not None:
+            last_message_at = datetime.fromisoformat(last_message_at)
+        return last_message_at, int(conversation_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def conversation_page(scope: str, user_id, limit: int, cursor=None):
+    """
+    (statement, params) for one page. One extra row is fetched so the
+    caller can tell whether there is a next page.
+    """
+    params = {"limit": limit + 1}
+    if scope == "user":
+        params["uid"] = user_id
+    if cursor is None:
+        return tables.CONVERSATION_PAGES[(scope, "first")], params
+    last_message_at, conversation_id = decode_cursor(cursor)
+    params["after_cid"] = conversation_id
+    if last_message_at is None:
+        return tables.CONVERSATION_PAGES[(scope, "null")], params
+    params["after_ts"] = last_message_at
+    return tables.CONVERSATION_PAGES[(scope, "timestamp")], params
+
+
+def page_response(rows, limit: int) -> dict:
+    page = rows[:limit]
+    return {
+        "conversations": page,
+        "next_cursor": encode_cursor(page[-1]) if len(rows) > limit else None,
+    }
+
+
+def inbox_etag(user_id, limit: int, cursor, version) -> str:
+    """ETag of one inbox page: the page parameters plus the SELECT_INBOX_VERSION row."""
+    return etags.make_etag("inbox", user_id, limit, cursor, *version)
@@ -0,0 +1,496 @@
+"""
+Core table metadata and the statements the handlers run.
+
+Statements are built once at import with explicit column lists, so each
+request reuses SQLAlchemy's compiled-statement cache instead of parsing
+a new text() string. The schema itself is owned by migrations/.
+"""
+from datetime import datetime, timezone
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    bindparam,
+    delete,
+    func,
+    insert,
+    or_,
+    case,
+    select,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects import sqlite
+
+metadata = MetaData()
+
+# SQLite 上按 CURRENT_TIMESTAMP 的格式存（不带微秒），否则同一秒的两种字符串比较结果不对
+Timestamp = DateTime().with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite",
+)
+
+
+def db_now() -> datetime:
+    """
+    Timestamp for rows written by the service: naive UTC at DATETIME
+    (second) precision, so a response built from it matches the stored row.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+users = Table(
+    "Users",
+    metadata,
+    Column("user_id", Integer, primary_key=True, autoincrement=False),
+    Column("uni", String(32), nullable=False),
+    Column("student_name", String(255)),
+    Column("email", String(255)),
+)
+
+conversations = Table(
+    "Conversations",
+    metadata,
+    Column("conversation_id", Integer, primary_key=True),
+    Column("user_a_id", Integer, nullable=False),
+    Column("user_b_id", Integer, nullable=False),
+    Column("created_at", Timestamp, nullable=False),
+    Column("last_message_at", Timestamp),
+    Column("version", Integer, nullable=False, server_default="0"),
+    Column("updated_at", Timestamp),
+    Column("edit_version", Integer, nullable=False, server_default="0"),
+)
+
+messages = Table(
+    "Messages",
+    metadata,
+    Column("message_id", Integer, primary_key=True),
+    Column("conversation_id", Integer, nullable=False),
+    Column("sender_id", Integer, nullable=False),
+    Column("message_type", String(16), nullable=False),
+    Column("body", Text, nullable=False),
+    Column("attachment_url", String(1024)),
+    Column("created_at", Timestamp, nullable=False),
+)
+
+# 每个用户的收件箱，一行一个 (user_id, conversation_id)，由写接口同步维护
+user_inbox = Table(
+    "UserInbox",
+    metadata,
+    Column("user_id", Integer, primary_key=True, autoincrement=False),
+    Column("conversation_id", Integer, primary_key=True, autoincrement=False),
+    Column("peer_id", Integer, nullable=False),
+    Column("peer_name", String(255)),
+    Column("peer_uni", String(32)),
+    Column("created_at", Timestamp, nullable=False),
+    Column("last_message_at", Timestamp),
+    Column("snippet", String(255)),
+    # 已读水位：该用户读到的最后一条 message_id
+    Column("last_read_message_id", Integer, nullable=False, server_default="0"),
+    Column("version", Integer, nullable=False, server_default="0"),
+)
+INBOX_SNIPPET_LENGTH = 100
+
+# Columns returned by ConversationRead / MessageRead
+CONVERSATION_COLUMNS = [
+    conversations.c.conversation_id,
+    conversations.c.user_a_id,
+    conversations.c.user_b_id,
+    conversations.c.created_at,
+    conversations.c.last_message_at,
+]
+MESSAGE_COLUMNS = [
+    messages.c.message_id,
+    messages.c.conversation_id,
+    messages.c.sender_id,
+    messages.c.message_type,
+    messages.c.body,
+    messages.c.attachment_url,
+    messages.c.created_at,
+]
+
+
+# ============================================================
+# Conversations
+# ============================================================
+
+_user_a = users.alias("ua")
+_user_b = users.alias("ub")
+
+# 对话列表，附带双方的姓名和 uni
+LIST_ALL_CONVERSATIONS = (
+    select(
+        *CONVERSATION_COLUMNS,
+        _user_a.c.student_name.label("user_a_name"),
+        _user_a.c.uni.label("user_a_uni"),
+        _user_b.c.student_name.label("user_b_name"),
+        _user_b.c.uni.label("user_b_uni"),
+    )
+    .select_from(
+        conversations
+        .outerjoin(_user_a, conversations.c.user_a_id == _user_a.c.user_id)
+        .outerjoin(_user_b, conversations.c.user_b_id == _user_b.c.user_id)
+    )
+)
+LIST_USER_CONVERSATIONS = LIST_ALL_CONVERSATIONS.where(
+    or_(conversations.c.user_a_id == bindparam("uid"), conversations.c.user_b_id == bindparam("uid"))
+)
+
+# admin 导出：全表按主键顺序流式读取
+EXPORT_CONVERSATIONS = LIST_ALL_CONVERSATIONS.order_by(conversations.c.conversation_id)
+
+
+def _after_cursor(table, with_timestamp: bool):
+    """
+    Keyset condition for rows after (last_message_at, conversation_id) in
+    newest-first order. NULL last_message_at sorts last on MySQL and SQLite,
+    so conversations without messages come after every dated one.
+    """
+    if not with_timestamp:
+        return (table.c.last_message_at.is_(None)) & (table.c.conversation_id < bindparam("after_cid"))
+    return or_(
+        table.c.last_message_at < bindparam("after_ts"),
+        (table.c.last_message_at == bindparam("after_ts")) & (table.c.conversation_id < bindparam("after_cid")),
+        table.c.last_message_at.is_(None),
+    )
+
+
+def _newest_first(columns):
+    return (columns.last_message_at.desc(), columns.conversation_id.desc())
+
+
+def _conversation_page(cursor: str):
+    """
+    One page of all conversations (admin), newest activity first, seeking
+    (last_message_at, conversation_id); both users' names are joined for
+    the page's rows only.
+    """
+    stmt = select(*CONVERSATION_COLUMNS)
+    if cursor != "first":
+        stmt = stmt.where(_after_cursor(conversations, cursor == "timestamp"))
+    page = stmt.order_by(*_newest_first(conversations.c)).limit(bindparam("limit")).subquery("page")
+
+    return (
+        select(
+            *[page.c[column.name] for column in CONVERSATION_COLUMNS],
+            _user_a.c.student_name.label("user_a_name"),
+            _user_a.c.uni.label("user_a_uni"),
+            _user_b.c.student_name.label("user_b_name"),
+            _user_b.c.uni.label("user_b_uni"),
+        )
+        .select_from(
+            page
+            .outerjoin(_user_a, page.c.user_a_id == _user_a.c.user_id)
+            .outerjoin(_user_b, page.c.user_b_id == _user_b.c.user_id)
+        )
+        .order_by(*_newest_first(page.c))
+    )
+
+
+def _inbox_select():
+    """
+    UserInbox rows in the conversation-list shape (user_a = the smaller id)
+    plus peer_*, snippet and unread_count. unread_count is a correlated
+    COUNT over the peer's messages after the read watermark, a range read on
+    ix_messages_conversation_unread per row, so the page stays one query.
+    """
+    me = users.alias("me")
+    a_is_me = user_inbox.c.user_id <= user_inbox.c.peer_id
+
+    def side(mine, peers):
+        return case((a_is_me, mine), else_=peers), case((a_is_me, peers), else_=mine)
+
+    user_a_id, user_b_id = side(user_inbox.c.user_id, user_inbox.c.peer_id)
+    user_a_name, user_b_name = side(me.c.student_name, user_inbox.c.peer_name)
+    user_a_uni, user_b_uni = side(me.c.uni, user_inbox.c.peer_uni)
+    unread_count = (
+        select(func.count())
+        .select_from(messages)
+        .where(
+            messages.c.conversation_id == user_inbox.c.conversation_id,
+            messages.c.message_id > user_inbox.c.last_read_message_id,
+            messages.c.sender_id != user_inbox.c.user_id,
+        )
+        .scalar_subquery()
+    )
+
+    return (
+        select(
+            user_inbox.c.conversation_id,
+            user_a_id.label("user_a_id"),
+            user_b_id.label("user_b_id"),
+            user_inbox.c.created_at,
+            user_inbox.c.last_message_at,
+            user_a_name.label("user_a_name"),
+            user_a_uni.label("user_a_uni"),
+            user_b_name.label("user_b_name"),
+            user_b_uni.label("user_b_uni"),
+            user_inbox.c.peer_id,
+            user_inbox.c.peer_name,
+            user_inbox.c.peer_uni,
+            user_inbox.c.snippet,
+            user_inbox.c.last_read_message_id,
+            unread_count.label("unread_count"),
+        )
+        .select_from(user_inbox.outerjoin(me, me.c.user_id == user_inbox.c.user_id))
+        .where(user_inbox.c.user_id == bindparam("uid"))
+    )
+
+
+def _inbox_page(cursor: str):
+    """One page of a user's inbox: a single range read on (user_id, last_message_at, conversation_id)."""
+    stmt = _inbox_select()
+    if cursor != "first":
+        stmt = stmt.where(_after_cursor(user_inbox, cursor == "timestamp"))
+    return stmt.order_by(*_newest_first(user_inbox.c)).limit(bindparam("limit"))
+
+
+# (scope, cursor) -> statement; scope "user" (UserInbox) | "all", cursor "first" | "timestamp" | "null"
+CONVERSATION_PAGES = {
+    (scope, cursor): (_inbox_page if scope == "user" else _conversation_page)(cursor)
+    for scope in ("user", "all")
+    for cursor in ("first", "timestamp", "null")
+}
+
+SELECT_CONVERSATION = select(*CONVERSATION_COLUMNS).where(
+    conversations.c.conversation_id == bindparam("cid")
+)
+# 删除前记下双方，读路由要把两个人的 GET /conversations 都切到主库
+SELECT_CONVERSATION_USERS = select(conversations.c.user_a_id, conversations.c.user_b_id).where(
+    conversations.c.conversation_id == bindparam("cid")
+)
+SELECT_CONVERSATION_BY_PAIR = select(*CONVERSATION_COLUMNS).where(
+    conversations.c.user_a_id == bindparam("user_a"),
+    conversations.c.user_b_id == bindparam("user_b"),
+)
+# created_at 由服务给（db_now），和 last_message_at / updated_at 用同一个 UTC 时钟
+INSERT_CONVERSATION = insert(conversations).values(
+    user_a_id=bindparam("user_a_id"), user_b_id=bindparam("user_b_id"), created_at=bindparam("created_at")
+)
+UPDATE_CONVERSATION = (
+    update(conversations)
+    .where(conversations.c.conversation_id == bindparam("cid"))
+    .values(user_a_id=bindparam("user_a_id"), user_b_id=bindparam("user_b_id"))
+)
+
+
+def _later(column, value):
+    return case((or_(column.is_(None), column < value), value), else_=column)
+
+
+# 发消息时更新对话：时间只前移，不会被并发的、较旧的值覆盖；version 每次都加，
+# 所以总能匹配到行，rowcount == 0 就是对话不存在
+BUMP_LAST_MESSAGE_AT = (
+    update(conversations)
+    .where(conversations.c.conversation_id == bindparam("cid"))
+    .values(
+        last_message_at=_later(conversations.c.last_message_at, bindparam("last_message_at")),
+        version=conversations.c.version + 1,
+        updated_at=_later(conversations.c.updated_at, bindparam("last_message_at")),
+    )
+)
+# 消息被修改 / 删除：edit_version 只在这里加，新消息不影响单条消息的 ETag
+BUMP_CONVERSATION_VERSION = (
+    update(conversations)
+    .where(conversations.c.conversation_id == bindparam("cid"))
+    .values(
+        version=conversations.c.version + 1,
+        edit_version=conversations.c.edit_version + 1,
+        updated_at=_later(conversations.c.updated_at, bindparam("updated_at")),
+    )
+)
+# 消息列表的校验值：只读对话这一行（主键）
+SELECT_CONVERSATION_VERSION = select(
+    conversations.c.created_at,
+    conversations.c.version,
+    conversations.c.edit_version,
+    func.coalesce(conversations.c.updated_at, conversations.c.created_at).label("updated_at"),
+).where(conversations.c.conversation_id == bindparam("cid"))
+# group commit：一批消息里哪些对话存在。write-behind 时不更新对话行，用共享锁挡住并发的删除
+SELECT_CONVERSATION_IDS = select(conversations.c.conversation_id).where(
+    conversations.c.conversation_id.in_(bindparam("cids", expanding=True))
+)
+SELECT_CONVERSATION_IDS_SHARED = SELECT_CONVERSATION_IDS.with_for_update(read=True)
+DELETE_CONVERSATION = delete(conversations).where(
+    conversations.c.conversation_id == bindparam("cid")
+)
+
+SELECT_USER_ID = select(users.c.user_id).where(users.c.user_id == bindparam("user_id"))
+INSERT_USER = insert(users).values(
+    user_id=bindparam("user_id"),
+    uni=bindparam("uni"),
+    student_name=bindparam("name"),
+    email=bindparam("email"),
+)
+
+
+# ============================================================
+# Messages
+# ============================================================
+
+LIST_MESSAGES = (
+    select(*MESSAGE_COLUMNS)
+    .where(messages.c.conversation_id == bindparam("cid"))
+    # 同一秒内的消息按 message_id 排，顺序稳定
+    .order_by(messages.c.created_at.asc(), messages.c.message_id.asc())
+)
+SELECT_MESSAGE = select(*MESSAGE_COLUMNS).where(messages.c.message_id == bindparam("mid"))
+# GET /messages/{id}：连同对话的 edit_version 一起读，用来生成 ETag
+SELECT_MESSAGE_VERSIONED = (
+    select(
+        *MESSAGE_COLUMNS,
+        conversations.c.created_at.label("conversation_created_at"),
+        conversations.c.edit_version.label("conversation_edit_version"),
+    )
+    .select_from(messages.join(conversations, conversations.c.conversation_id == messages.c.conversation_id))
+    .where(messages.c.message_id == bindparam("mid"))
+)
+# INSERT ... SELECT FROM Conversations：对话不存在时插入 0 行（rowcount == 0），
+# 不依赖外键（v001 不会给已有的表补外键）
+_MESSAGE_VALUES = ["sender_id", "message_type", "body", "attachment_url", "created_at"]
+INSERT_MESSAGE = insert(messages).from_select(
+    ["conversation_id", *_MESSAGE_VALUES],
+    select(
+        conversations.c.conversation_id,
+        *(bindparam(name, type_=messages.c[name].type) for name in _MESSAGE_VALUES),
+    ).where(conversations.c.conversation_id == bindparam("conversation_id")),
+)
+# 批量插入并按参数顺序返回 message_id（SQLite / MariaDB 等支持 RETURNING 的库）
+INSERT_MESSAGES_RETURNING = insert(messages).returning(
+    messages.c.message_id, sort_by_parameter_order=True
+)
+UPDATE_MESSAGE = (
+    update(messages)
+    .where(messages.c.message_id == bindparam("mid"))
+    .values(
+        body=bindparam("body"),
+        message_type=bindparam("message_type"),
+        attachment_url=bindparam("attachment_url"),
+    )
+)
+DELETE_MESSAGE = delete(messages).where(messages.c.message_id == bindparam("mid"))
+
+
+# ============================================================
+# Inbox
+# ============================================================
+
+def message_snippet(body: str) -> str:
+    return body[:INBOX_SNIPPET_LENGTH]
+
+
+def _latest_snippet(conversation_id):
+    return (
+        select(func.substr(messages.c.body, 1, INBOX_SNIPPET_LENGTH))
+        .where(messages.c.conversation_id == conversation_id)
+        .order_by(messages.c.created_at.desc(), messages.c.message_id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def _inbox_side(me, peer_id):
+    peer = users.alias("peer")
+    return (
+        select(
+            me,
+            conversations.c.conversation_id,
+            peer_id,
+            peer.c.student_name,
+            peer.c.uni,
+            conversations.c.created_at,
+            conversations.c.last_message_at,
+            _latest_snippet(conversations.c.conversation_id),
+        )
+        .select_from(conversations.outerjoin(peer, peer.c.user_id == peer_id))
+        .where(conversations.c.conversation_id == bindparam("cid"))
+    )
+
+
+# 对话的两行收件箱，从 Conversations / Users / 最新消息生成（自己和自己的对话只有一行）
+INSERT_INBOX = insert(user_inbox).from_select(
+    [
+        "user_id", "conversation_id", "peer_id", "peer_name", "peer_uni",
+        "created_at", "last_message_at", "snippet",
+    ],
+    union_all(
+        _inbox_side(conversations.c.user_a_id, conversations.c.user_b_id),
+        _inbox_side(conversations.c.user_b_id, conversations.c.user_a_id).where(
+            conversations.c.user_a_id != conversations.c.user_b_id
+        ),
+    ),
+)
+DELETE_INBOX = delete(user_inbox).where(user_inbox.c.conversation_id == bindparam("cid"))
+# 重建收件箱行（对话双方变了）前后保留每个用户的已读水位和 version，version 再加 1
+SELECT_INBOX_STATE = select(
+    user_inbox.c.user_id, user_inbox.c.last_read_message_id, user_inbox.c.version
+).where(user_inbox.c.conversation_id == bindparam("cid"))
+RESTORE_INBOX_STATE = (
+    update(user_inbox)
+    .where(
+        user_inbox.c.conversation_id == bindparam("cid"),
+        user_inbox.c.user_id == bindparam("uid"),
+    )
+    .values(
+        last_read_message_id=bindparam("mid"),
+        version=bindparam("prev_version") + 1,
+    )
+)
+# 新消息：行总是命中、version 总是加 1（收件箱 ETag 要变）；last_message_at / snippet 只前移，
+# 同一秒内后到的消息也会更新 snippet。snippet 放在前面：MySQL 的 SET 从左到右求值，后面看到的是新值
+_inbox_is_older = or_(
+    user_inbox.c.last_message_at.is_(None),
+    user_inbox.c.last_message_at <= bindparam("last_message_at"),
+)
+BUMP_INBOX = (
+    update(user_inbox)
+    .where(user_inbox.c.conversation_id == bindparam("cid"))
+    .ordered_values(
+        (user_inbox.c.snippet, case((_inbox_is_older, bindparam("snippet")), else_=user_inbox.c.snippet)),
+        (user_inbox.c.last_message_at, _later(user_inbox.c.last_message_at, bindparam("last_message_at"))),
+        (user_inbox.c.version, user_inbox.c.version + 1),
+    )
+)
+# write-behind flush 用：snippet 直接取对话最新一条消息（created_at, message_id），
+# 不取决于各请求 add() 的先后；flush 时这些消息都已提交
+BUMP_INBOX_LATEST = (
+    update(user_inbox)
+    .where(user_inbox.c.conversation_id == bindparam("cid"))
+    .ordered_values(
+        (user_inbox.c.snippet, _latest_snippet(bindparam("cid"))),
+        (user_inbox.c.last_message_at, _later(user_inbox.c.last_message_at, bindparam("last_message_at"))),
+        (user_inbox.c.version, user_inbox.c.version + 1),
+    )
+)
+# 消息被修改 / 删除后重新取最新一条的 snippet
+REFRESH_INBOX_SNIPPET = (
+    update(user_inbox)
+    .where(user_inbox.c.conversation_id == bindparam("cid"))
+    .values(snippet=_latest_snippet(bindparam("cid")), version=user_inbox.c.version + 1)
+)
+
+SELECT_INBOX_ROW = _inbox_select().where(user_inbox.c.conversation_id == bindparam("cid"))
+# 标记已读：水位只前移；不传 message_id 时读到对话的最新消息
+MARK_READ = (
+    update(user_inbox)
+    .where(
+        user_inbox.c.user_id == bindparam("uid"),
+        user_inbox.c.conversation_id == bindparam("cid"),
+        user_inbox.c.last_read_message_id < bindparam("mid"),
+    )
+    .values(last_read_message_id=bindparam("mid"), version=user_inbox.c.version + 1)
+)
+# 收件箱版本：行数 + 最新活动 + 各行 version 之和，任何一行变化都会变；主键上的范围读
+SELECT_INBOX_VERSION = select(
+    func.count(),
+    func.max(user_inbox.c.last_message_at),
+    func.coalesce(func.sum(user_inbox.c.version), 0),
+).where(user_inbox.c.user_id == bindparam("uid"))
+SELECT_LATEST_MESSAGE_ID = select(func.max(messages.c.message_id)).where(
+    messages.c.conversation_id == bindparam("cid")
+)
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database  # noqa: E402
+import migrate  # noqa: E402
+
+
+@pytest.fixture
+def db_engine(tmp_path):
+    """Engine on a freshly migrated SQLite database."""
+    engine = database.make_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    with engine.begin() as conn:
+        migrate.upgrade_conn(conn)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def conn(db_engine):
+    with db_engine.begin() as conn:
+        yield conn
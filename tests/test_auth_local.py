@@ -0,0 +1,118 @@
+"""AUTH_MODE=local against a local stand-in for the Security Service (JWKS + decode)."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import rsa
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from jose import jwk, jwt
+
+import auth_utils
+
+
+def make_key():
+    public, private = rsa.newkeys(1024)
+    return private.save_pkcs1().decode(), jwk.construct(public.save_pkcs1().decode(), "RS256").to_dict()
+
+
+SIGNING_KEY, PUBLIC_JWK = make_key()
+OTHER_KEY, _ = make_key()
+
+
+def sign(kid="k1", key=SIGNING_KEY, expires_in=60):
+    claims = {"sub": "5", "role": "user", "exp": int(time.time() + expires_in)}
+    return jwt.encode(claims, key, algorithm="RS256", headers={"kid": kid})
+
+
+class StubSecurity(BaseHTTPRequestHandler):
+    jwks = None
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(("GET", self.path))
+        self._send(200, self.jwks)
+
+    def do_POST(self):
+        self.requests.append(("POST", self.path))
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self._send(200, {"user_id": 42, "role": "user"})
+
+    def _send(self, status, body):
+        raw = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def security(monkeypatch):
+    StubSecurity.jwks = {"keys": [dict(PUBLIC_JWK, kid="k1")]}
+    StubSecurity.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubSecurity)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}/security"
+    monkeypatch.setattr(auth_utils, "AUTH_MODE", "local")
+    monkeypatch.setattr(auth_utils, "SECURITY_SERVICE_URL", f"{base}/decode")
+    monkeypatch.setattr(auth_utils, "jwks", auth_utils.KeySet(f"{base}/jwks", 3600))
+    monkeypatch.setattr(auth_utils, "breaker", auth_utils.CircuitBreaker(20, 5, 0.5, 30))
+    auth_utils.token_cache.clear()
+    auth_utils.rejected_tokens.clear()
+    yield StubSecurity
+    server.shutdown()
+    server.server_close()
+    auth_utils.token_cache.clear()
+    auth_utils.rejected_tokens.clear()
+
+
+def verify(token):
+    return auth_utils.verify_token(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+
+
+def remote_calls(stub):
+    return [path for method, path in stub.requests if method == "POST"]
+
+
+def test_known_kid_is_verified_locally(security):
+    identity = verify(sign())
+    assert identity["user_id"] == 5 and identity["role"] == "user"
+    assert remote_calls(security) == []
+
+
+def test_unknown_kid_falls_back_to_remote(security):
+    assert verify(sign(kid="rotated"))["user_id"] == 42
+    assert remote_calls(security) == ["/security/decode"]
+
+
+@pytest.mark.parametrize("token", [
+    pytest.param(lambda: sign(key=OTHER_KEY), id="bad-signature"),
+    pytest.param(lambda: sign(expires_in=-60), id="expired"),
+])
+def test_rejected_token_is_401_and_negatively_cached(security, token):
+    token = token()
+    with pytest.raises(HTTPException) as exc:
+        verify(token)
+    assert exc.value.status_code == 401
+    assert auth_utils.rejected_tokens.get(auth_utils.token_key(token)) is not None
+    assert remote_calls(security) == []
+
+
+@pytest.mark.parametrize("body", [[], "keys", {"keys": "k1"}, {"keys": ["k1"]}])
+def test_malformed_jwks_is_a_failed_refresh(security, body):
+    security.jwks = body
+    # 刷新失败：没有可用的公钥，回退到远程校验而不是 500
+    assert verify(sign())["user_id"] == 42
+
+
+def test_failed_refresh_keeps_the_previous_keys(security):
+    auth_utils.jwks.refresh()
+    security.jwks = []
+    auth_utils.jwks.refresh()
+    assert verify(sign())["user_id"] == 5
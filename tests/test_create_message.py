@@ -0,0 +1,65 @@
+"""POST /messages error handling in the default, write-behind and group-commit modes."""
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import insert
+
+import group_commit
+import main
+import tables
+import write_behind
+from models.message_models import MessageCreate
+
+MODES = ["default", "write_behind", "group_commit"]
+
+
+@pytest.fixture(params=MODES)
+def mode(request, db_engine, monkeypatch):
+    monkeypatch.setattr(main, "engine", db_engine)
+    monkeypatch.setattr(write_behind, "LAST_MESSAGE_WRITE_BEHIND", request.param == "write_behind")
+    monkeypatch.setattr(group_commit, "MESSAGE_GROUP_COMMIT", request.param == "group_commit")
+    monkeypatch.setattr(write_behind, "last_message_at", write_behind.TouchBuffer(1))
+    monkeypatch.setattr(group_commit, "messages", group_commit.GroupCommitter(8, 0))
+    with db_engine.begin() as conn:
+        conn.execute(insert(tables.users), [{"user_id": 1, "uni": "ab1234"}, {"user_id": 2, "uni": "cd5678"}])
+        conn.execute(tables.INSERT_CONVERSATION, {"user_a_id": 1, "user_b_id": 2, "created_at": tables.db_now()})
+        conn.execute(tables.INSERT_INBOX, {"cid": 1})
+    return request.param
+
+
+def post(conversation_id, sender_id):
+    return main.create_message(MessageCreate(conversation_id=conversation_id, sender_id=sender_id, body="hi"))
+
+
+def test_message_is_written(mode):
+    assert post(1, 1)["message_id"] == 1
+
+
+def test_unknown_conversation_is_404(mode):
+    with pytest.raises(HTTPException) as exc:
+        post(99, 1)
+    assert exc.value.status_code == 404
+
+
+def test_unknown_sender_is_422(mode):
+    with pytest.raises(HTTPException) as exc:
+        post(1, 99)
+    assert exc.value.status_code == 422
+
+
+def test_older_timestamp_does_not_move_last_message_at_back(db_engine, monkeypatch):
+    monkeypatch.setattr(main, "engine", db_engine)
+    monkeypatch.setattr(write_behind, "LAST_MESSAGE_WRITE_BEHIND", False)
+    with db_engine.begin() as conn:
+        conn.execute(insert(tables.users), [{"user_id": 1, "uni": "ab1234"}, {"user_id": 2, "uni": "cd5678"}])
+        conn.execute(tables.INSERT_CONVERSATION, {"user_a_id": 1, "user_b_id": 2, "created_at": tables.db_now()})
+    now = tables.db_now()
+    for created_at in (now, now - timedelta(seconds=5)):
+        main.insert_message({
+            "conversation_id": 1, "sender_id": 1, "message_type": "TEXT",
+            "body": "hi", "attachment_url": None, "created_at": created_at,
+        })
+    with db_engine.connect() as conn:
+        version = conn.execute(tables.SELECT_CONVERSATION_VERSION, {"cid": 1}).one()
+    assert version.updated_at == now and version.version == 2
@@ -0,0 +1,18 @@
+"""EXPLAIN every hot query (the statements in tables.py) on a freshly migrated database."""
+import pytest
+from sqlalchemy import text
+
+import migrate
+
+
+@pytest.mark.parametrize("name", [query[0] for query in migrate.HOT_QUERIES])
+def test_hot_query_uses_index(conn, name):
+    results = {result[0]: result for result in migrate.check_queries(conn)}
+    _, ok, used, missing, full_scan = results[name]
+    assert ok, f"{name}: indexes={sorted(used)} missing={missing} full_scan={full_scan}"
+
+
+def test_check_fails_when_an_index_is_dropped(conn):
+    conn.execute(text("DROP INDEX ix_messages_conversation_created"))
+    results = {result[0]: result[1] for result in migrate.check_queries(conn)}
+    assert not results["list_messages"]
@@ -0,0 +1,101 @@
+"""identity_client against a local stub of the identity service."""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import identity_client
+
+USERS = {1: {"user_id": 1, "uni": "ab1234"}, 2: {"user_id": 2, "uni": "cd5678"}, 3: {"user_id": 3, "uni": "ef9012"}}
+
+
+class StubIdentity(BaseHTTPRequestHandler):
+    batch = True
+    status = None
+    requests = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.requests.append(self.path)
+        if self.status is not None:
+            return self._send(self.status, {"detail": "down"})
+        if url.path == "/users" and self.batch:
+            ids = [int(uid) for uid in parse_qs(url.query)["ids"][0].split(",")]
+            return self._send(200, {"users": [USERS[uid] for uid in ids if uid in USERS]})
+        if url.path.startswith("/users/"):
+            user = USERS.get(int(url.path.rsplit("/", 1)[1]))
+            return self._send(200, user) if user else self._send(404, {"detail": "not found"})
+        self._send(404, {"detail": "not found"})
+
+    def _send(self, status, body):
+        raw = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    StubIdentity.batch = True
+    StubIdentity.status = None
+    StubIdentity.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubIdentity)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(identity_client, "IDENTITY_SERVICE_URL", f"http://127.0.0.1:{server.server_port}")
+    identity_client.user_cache.clear()
+    yield StubIdentity
+    server.shutdown()
+    server.server_close()
+    identity_client.user_cache.clear()
+
+
+def test_single_lookup_uses_user_endpoint_and_cache(stub):
+    assert identity_client.get_user_uni(1) == "ab1234"
+    assert identity_client.get_user_uni(1) == "ab1234"
+    assert stub.requests == ["/users/1"]
+
+
+def test_unknown_user_falls_back_to_placeholder(stub):
+    assert identity_client.get_user_uni(99) == "user_99"
+
+
+def test_batch_fetches_only_misses_in_one_call(stub):
+    identity_client.get_user(1)
+    users = identity_client.get_users([1, 2, 3, 99])
+    assert {uid: u["uni"] for uid, u in users.items()} == {1: "ab1234", 2: "cd5678", 3: "ef9012"}
+    assert stub.requests == ["/users/1", "/users?ids=2%2C3%2C99"]
+
+
+def test_batch_respects_batch_size(stub, monkeypatch):
+    monkeypatch.setattr(identity_client, "IDENTITY_BATCH_SIZE", 2)
+    identity_client.get_users([1, 2, 3])
+    assert stub.requests == ["/users?ids=1%2C2", "/users/3"]
+
+
+def test_missing_batch_endpoint_falls_back_to_single_lookups(stub):
+    stub.batch = False
+    users = identity_client.get_users([1, 2, 99])
+    assert sorted(users) == [1, 2]
+    assert stub.requests == ["/users?ids=1%2C2%2C99", "/users/1", "/users/2", "/users/99"]
+
+
+def test_error_status_is_logged_and_not_cached(stub, caplog):
+    stub.status = 503
+    with caplog.at_level("WARNING"):
+        assert identity_client.get_users([1, 2]) == {}
+    assert "identity.non_200" in caplog.text
+    stub.status = None
+    assert identity_client.get_user_uni(1) == "ab1234"
+
+
+def test_unreachable_service_degrades_to_placeholder(monkeypatch):
+    monkeypatch.setattr(identity_client, "IDENTITY_SERVICE_URL", "http://127.0.0.1:9")
+    identity_client.user_cache.clear()
+    assert identity_client.get_user_uni(5) == "user_5"
@@ -0,0 +1,35 @@
+"""Message order within one second and the conversation clock."""
+from datetime import datetime
+
+from sqlalchemy import insert
+
+import main
+import tables
+from models.conversation_models import ConversationCreate
+
+
+def test_same_second_messages_come_back_in_insert_order(conn):
+    conn.execute(insert(tables.users), [{"user_id": 1, "uni": "ab1234"}, {"user_id": 2, "uni": "cd5678"}])
+    now = tables.db_now()
+    cid = conn.execute(tables.INSERT_CONVERSATION, {"user_a_id": 1, "user_b_id": 2, "created_at": now}).lastrowid
+    ids = [
+        conn.execute(tables.INSERT_MESSAGE, {
+            "conversation_id": cid, "sender_id": 1, "message_type": "TEXT",
+            "body": f"m{i}", "attachment_url": None, "created_at": now,
+        }).lastrowid
+        for i in range(5)
+    ]
+    rows = conn.execute(tables.LIST_MESSAGES, {"cid": cid}).all()
+    assert [row.message_id for row in rows] == ids
+
+
+def test_create_conversation_takes_created_at_from_the_service_clock(db_engine, monkeypatch):
+    # 一个明显不是数据库当前时间的值：列默认值 / NOW() 写不出它
+    stamp = datetime(2020, 1, 2, 3, 4, 5)
+    monkeypatch.setattr(main, "engine", db_engine)
+    monkeypatch.setattr(tables, "db_now", lambda: stamp)
+    row = main.create_conversation(ConversationCreate(user_a_id=1, user_b_id=2))
+    assert row["created_at"] == stamp
+    with db_engine.connect() as conn:
+        version = conn.execute(tables.SELECT_CONVERSATION_VERSION, {"cid": row["conversation_id"]}).one()
+    assert version.created_at == version.updated_at == stamp
@@ -0,0 +1,104 @@
+"""ReadRouter with a primary and a replica on two SQLite files."""
+import time
+
+import pytest
+from sqlalchemy import insert, select
+
+import database
+import main
+import migrate
+import tables
+from models.conversation_models import ConversationCreate
+from models.message_models import MessageCreate
+
+
+def migrated(path, uni):
+    engine = database.make_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        migrate.upgrade_conn(conn)
+        # 同一个用户在两个库里的 uni 不同，用来看读到的是哪个库
+        conn.execute(insert(tables.users), [
+            {"user_id": 1, "uni": uni}, {"user_id": 2, "uni": "cd5678"}, {"user_id": 3, "uni": "ef9012"},
+        ])
+    return engine
+
+
+@pytest.fixture
+def primary(tmp_path):
+    engine = migrated(tmp_path / "primary.db", "primary")
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def router(primary, tmp_path, monkeypatch):
+    replica = migrated(tmp_path / "replica.db", "replica")
+    router = database.ReadRouter(primary, [replica])
+    monkeypatch.setattr(main, "engine", primary)
+    monkeypatch.setattr(main, "read_router", router)
+    yield router
+    replica.dispose()
+
+
+def read_from(router, **key):
+    with router.connect(**key) as conn:
+        return conn.execute(select(tables.users.c.uni).where(tables.users.c.user_id == 1)).scalar()
+
+
+def test_reads_go_to_the_replica(router):
+    assert read_from(router, user_id=1) == "replica"
+    assert read_from(router, conversation_id=1) == "replica"
+
+
+def test_recent_writes_read_from_the_primary_until_the_window_passes(router, monkeypatch):
+    monkeypatch.setattr(database, "READ_YOUR_WRITES_SECONDS", 0.2)
+    router.note_write(user_id=1, conversation_id=7)
+    assert read_from(router, user_id=1) == "primary"
+    assert read_from(router, conversation_id=7) == "primary"
+    assert read_from(router, user_id=2) == "replica"
+    time.sleep(0.25)
+    assert read_from(router, user_id=1) == "replica"
+
+
+def test_unreachable_replica_falls_back_to_the_primary(primary, tmp_path):
+    # 目录不存在，SQLite 打不开这个文件
+    replica = database.make_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    router = database.ReadRouter(primary, [replica])
+    assert read_from(router, user_id=1) == "primary"
+    # 标记为不可用后，在 DB_REPLICA_RETRY_SECONDS 内不再尝试
+    assert router.candidates(user_id=1) == [primary]
+
+
+def create_conversation(engine):
+    with engine.begin() as conn:
+        cid = conn.execute(
+            tables.INSERT_CONVERSATION, {"user_a_id": 1, "user_b_id": 2, "created_at": tables.db_now()}
+        ).lastrowid
+        conn.execute(tables.INSERT_INBOX, {"cid": cid})
+    return cid
+
+
+def test_delete_conversation_routes_both_participants_to_the_primary(router, primary):
+    cid = create_conversation(primary)
+    main.delete_conversation(cid)
+    assert router.candidates(user_id=1) == router.candidates(user_id=2) == [primary]
+    assert router.candidates(user_id=3) != [primary]
+
+
+def test_update_conversation_routes_old_and_new_participants_to_the_primary(router, primary):
+    cid = create_conversation(primary)
+    main.update_conversation(cid, ConversationCreate(user_a_id=1, user_b_id=3))
+    for user_id in (1, 2, 3):
+        assert router.candidates(user_id=user_id) == [primary]
+
+
+def test_update_message_routes_the_messages_own_conversation(router, primary):
+    cid = create_conversation(primary)
+    with primary.begin() as conn:
+        mid = conn.execute(tables.INSERT_MESSAGE, {
+            "conversation_id": cid, "sender_id": 1, "message_type": "TEXT",
+            "body": "hi", "attachment_url": None, "created_at": tables.db_now(),
+        }).lastrowid
+    main.update_message(mid, MessageCreate(conversation_id=cid + 1, sender_id=1, body="edited"))
+    assert router.candidates(conversation_id=cid) == [primary]
+    assert router.candidates(conversation_id=cid + 1) != [primary]
@@ -0,0 +1,55 @@
+"""AsyncSingleFlight: coalescing and leader cancellation."""
+import asyncio
+
+from auth_utils import AsyncSingleFlight
+
+
+def run_flight(cancel):
+    async def scenario():
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        tasks = [asyncio.create_task(flight.do("token", fn))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(flight.do("token", fn)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        cancel(tasks)
+        return await asyncio.gather(*tasks, return_exceptions=True), len(calls)
+
+    return asyncio.run(scenario())
+
+
+def test_concurrent_calls_share_one_result():
+    results, calls = run_flight(lambda tasks: None)
+    assert results == [1, 1, 1, 1] and calls == 1
+
+
+def test_leader_cancellation_does_not_cancel_followers():
+    results, calls = run_flight(lambda tasks: tasks[0].cancel())
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert results[1:] == [2, 2, 2] and calls == 2
+
+
+def test_follower_cancellation_stays_with_the_follower():
+    results, calls = run_flight(lambda tasks: tasks[1].cancel())
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert [results[0]] + results[2:] == [1, 1, 1] and calls == 1
+
+
+def test_errors_reach_every_caller():
+    async def scenario():
+        flight = AsyncSingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            raise ValueError("bad token")
+
+        return await asyncio.gather(*(flight.do("token", fn) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, ValueError) for r in results)
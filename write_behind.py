@@ -0,0 +1,154 @@
+"""
+Write-behind for Conversations.last_message_at and the UserInbox rows.
+
+With LAST_MESSAGE_WRITE_BEHIND=1, create_message only inserts the message
+and records the bump here; a background flusher applies all pending bumps
+every LAST_MESSAGE_FLUSH_MS in one transaction, so senders in a busy chat
+stop queueing on the conversation row lock. Readers that need the exact
+value call flush() / flush_async() first.
+"""
+import asyncio
+import logging
+import os
+import threading
+
+import tables
+from log_utils import log_event
+
+LAST_MESSAGE_WRITE_BEHIND = os.getenv("LAST_MESSAGE_WRITE_BEHIND", "0") == "1"
+LAST_MESSAGE_FLUSH_MS = float(os.getenv("LAST_MESSAGE_FLUSH_MS", "5"))
+
+
+class TouchBuffer:
+    """Latest pending last_message_at per conversation, flushed in batches."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.flushes = 0
+        self.bumps = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        # 同一时间只有一个 flush 在写，强制 flush 返回时之前的 bump 一定已提交
+        self._flush_lock = threading.Lock()
+        self._async_flush_lock = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._task = None
+
+    def add(self, conversation_id: int, last_message_at):
+        with self._lock:
+            current = self._pending.get(conversation_id)
+            if current is None or last_message_at > current:
+                self._pending[conversation_id] = last_message_at
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def has_pending(self, conversation_id: int) -> bool:
+        return conversation_id in self._pending
+
+    def _drain(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        return [{"cid": cid, "last_message_at": ts} for cid, ts in sorted(batch.items())]
+
+    def _restore(self, batch):
+        for params in batch:
+            self.add(params["cid"], params["last_message_at"])
+
+    def _record(self, batch):
+        self.flushes += 1
+        self.bumps += len(batch)
+
+    def flush(self, engine):
+        """Apply every pending bump now (sync engine)."""
+        with self._flush_lock:
+            batch = self._drain()
+            if not batch:
+                return
+            try:
+                with engine.begin() as conn:
+                    conn.execute(tables.BUMP_LAST_MESSAGE_AT, batch)
+                    conn.execute(tables.BUMP_INBOX_LATEST, batch)
+            except Exception:
+                self._restore(batch)
+                raise
+            self._record(batch)
+
+    async def flush_async(self, engine):
+        """Apply every pending bump now (async engine)."""
+        if self._async_flush_lock is None:
+            self._async_flush_lock = asyncio.Lock()
+        async with self._async_flush_lock:
+            batch = self._drain()
+            if not batch:
+                return
+            try:
+                async with engine.begin() as conn:
+                    await conn.execute(tables.BUMP_LAST_MESSAGE_AT, batch)
+                    await conn.execute(tables.BUMP_INBOX_LATEST, batch)
+            except Exception:
+                self._restore(batch)
+                raise
+            self._record(batch)
+
+    def start(self, engine):
+        """Background flusher thread for the sync engine."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(engine,), name="last-message-flusher", daemon=True)
+        self._thread.start()
+
+    def _run(self, engine):
+        while not self._stop.wait(self.interval):
+            if not self._pending:
+                continue
+            try:
+                self.flush(engine)
+            except Exception as e:
+                log_event("write_behind.flush_failed", logging.WARNING, pending=self.pending(), error=str(e))
+
+    def start_async(self, engine):
+        """Background flusher task for the async engine; call from the running loop."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run_async(engine))
+
+    async def _run_async(self, engine):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self._pending:
+                continue
+            try:
+                await self.flush_async(engine)
+            except Exception as e:
+                log_event("write_behind.flush_failed", logging.WARNING, pending=self.pending(), error=str(e))
+
+    def stop(self, engine):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush(engine)
+
+    async def stop_async(self, engine):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_async(engine)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": LAST_MESSAGE_WRITE_BEHIND,
+            "pending": self.pending(),
+            "flushes": self.flushes,
+            "bumps": self.bumps,
+            "bumps_per_flush": self.bumps / self.flushes if self.flushes else 0.0,
+        }
+
+
+last_message_at = TouchBuffer(LAST_MESSAGE_FLUSH_MS / 1000)